@@ -78,6 +78,7 @@ ADD
 ####################
 import ResearchModules
 import WUNDERScrape
+import GSL_equation_of_state
 
 import os
 import sys
@@ -187,6 +188,13 @@ density = {
 date_fmt = '%Y-%m-%d'
 gravity_factor = 9.80665
 
+# Density sensitivity sweep (see run_density_sensitivity)
+sensitivity_densities = np.round(np.arange(1.00, 1.225, 0.01), 2) # g/cm3
+sensitivity_salinities = np.arange(100, 280, 20)    # g/L, for EOS scenarios
+sensitivity_temps = np.arange(0, 35, 5)             # degrees C
+sensitivity_percentiles = [5, 25, 50, 75, 95]       # Percentile bands
+sensitivity_chunk_rows = 50000  # Timestamps processed at once
+
 
 
 ####################
@@ -452,7 +460,8 @@ def trim_HOBO(data, logger_type):
         data, cols_data, row_start = toprow, row_end = botrow)
         
     # Reindex matrix
-    data['timestamp'] = pd.to_datetime(data.index.values.tolist())
+    data['timestamp'] = ResearchModules.parse_timestamps(
+        data.index, errors='raise')
     data.set_index('timestamp', inplace = True)
     
     return data
@@ -488,7 +497,8 @@ def loadHOBOFiles():
         # Drop na rows (rows with no values)
         data = data.loc[data.index.dropna()]
         # Convert datetime strings to datetime objects
-        data['datetime'] = pd.to_datetime(data.index)
+        data['datetime'] = ResearchModules.parse_timestamps(
+            data.index, label=location + ' timestamps', errors='raise')
         time_min = str(min(data['datetime']).date())
         time_max = str(max(data['datetime']).date())
         # Do depth calculations
@@ -511,8 +521,9 @@ def get_files_from_server():
             GSLMO_data_URL + file_info['filename'],
             header = file_info['header'],
             error_bad_lines=False)
-        GSLMO_data[file].index = pd.to_datetime(
-            GSLMO_data[file][file_info['timecol']])
+        GSLMO_data[file].index = ResearchModules.parse_timestamps(
+            GSLMO_data[file][file_info['timecol']], label=file,
+            errors='raise')
     return GSLMO_data
 
 
@@ -783,8 +794,8 @@ def combine_weather_files():
     # Delete replicate rows
     combined_weather_data.drop_duplicates(subset=['DateTime'], inplace = True)
     # Replace index with timestamp and sort
-    combined_weather_data['DateTime'] = pd.to_datetime(
-        combined_weather_data['DateTime'])
+    combined_weather_data['DateTime'] = ResearchModules.parse_timestamps(
+        combined_weather_data['DateTime'], errors='raise')
     combined_weather_data.set_index(['DateTime'], drop=True, inplace=True)
     combined_weather_data.sort_index(inplace=True)
     # Find start and end date
@@ -885,8 +896,8 @@ def convert_weather_station_data(combined_weather_data, fmt):
     '''
     # Replace index with timestamp and sort
     print('Parsing timestamps...')
-    combined_weather_data['DateTime'] = pd.to_datetime(
-        combined_weather_data.index)
+    combined_weather_data['DateTime'] = ResearchModules.parse_timestamps(
+        combined_weather_data.index, errors='raise')
     combined_weather_data.set_index(['DateTime'], drop=True, inplace=True)
     combined_weather_data.sort_index(inplace=True)
     combined_weather_data = combined_weather_data[
@@ -902,12 +913,13 @@ def convert_weather_station_data(combined_weather_data, fmt):
     
     # Convert weather station data
     print('Converting units...')
-    combined_weather_data['ws_abs_pressure_kPa'] = (
-        combined_weather_data['ws_abs_pressure_inHg']*3.386)
-    combined_weather_data['ws_rel_pressure_kPa'] = (
-        combined_weather_data['ws_rel_pressure_inHg']*3.386)
-    combined_weather_data['ws_air_temp_C'] = F_to_C(
-        combined_weather_data['ws_temp_F'])
+    combined_weather_data[['ws_abs_pressure_kPa', 'ws_rel_pressure_kPa']] = (
+        ResearchModules.convert_units(
+            combined_weather_data[
+                ['ws_abs_pressure_inHg', 'ws_rel_pressure_inHg']].to_numpy(),
+            'inHg_to_kPa'))
+    combined_weather_data['ws_air_temp_C'] = ResearchModules.convert_units(
+        combined_weather_data['ws_temp_F'], 'F_to_C')
     
     # Resample to 15 minute intervals and rename columns
     print('Resampling weather data to 15 minute intervals...')
@@ -917,11 +929,6 @@ def convert_weather_station_data(combined_weather_data, fmt):
     return combined_weather_data, ws_resampled
 
 
-def F_to_C(T_F):
-    T_C = (T_F-32)*5/9
-    return T_C
-       
-
 def update_station_cache(sdate_min, sdate_max):
     """
     This functions updates the cache of weather data.
@@ -980,20 +987,18 @@ def format_scraped_weatherdata(scraped_filename, station_elev_ft):
         'Pressure (in)'     : 'ws_air_pressure_inHg',
         }
     
-    # Read in and format data table
-    station_data = pd.read_csv(
-        scraped_filename, sep=',', header = 0, index_col = 0, na_values = '--')
-    
-    for col in list(data_cols):
-        station_data[col] = station_data[col].astype(float)
+    # Read in the typed data table
+    station_data = WUNDERScrape.load_station_file(
+        scraped_filename).set_index('Time')
         
     # Rename columns
     station_data.rename(data_cols, inplace=True, axis=1)
     station_data.index.rename('DateTime', inplace=True)
 
     # Convert units
-    station_elev_m = 0.3048 * station_elev_ft
-    station_data['ws_air_temp_C'] = 5/9*(station_data['ws_temp_F'] - 32)
+    station_elev_m = ResearchModules.convert_units(station_elev_ft, 'ft_to_m')
+    station_data['ws_air_temp_C'] = ResearchModules.convert_units(
+        station_data['ws_temp_F'], 'F_to_C')
     
     # Calculate aboslute pressure
     station_data['ws_abs_pressure_inHg'] = ResearchModules.convert_pressure(
@@ -1002,7 +1007,7 @@ def format_scraped_weatherdata(scraped_filename, station_elev_ft):
         conv_type = 'rel_to_abs')
     
     # Save the file (overwrite the original)
-    station_data.to_csv(scraped_filename[:-4]+'_conv.csv')
+    station_data.to_csv(os.path.splitext(scraped_filename)[0]+'_conv.csv')
     
     return station_data
        
@@ -1026,6 +1031,205 @@ def calc_density(pressure_water, pressure_air, water_depth):
     return density
     
 
+def density_scenarios(salinities=sensitivity_salinities,
+                      temps=sensitivity_temps):
+    '''
+    Builds density scenarios from every combination of salinity and
+    temperature, using the GSL equation of state.
+
+    Parameters
+    ----------
+    salinities : array-like, optional
+        Salinities in g/L. The default is sensitivity_salinities.
+    temps : array-like, optional
+        Temperatures in degrees C. The default is sensitivity_temps.
+
+    Returns
+    -------
+    scenarios : pandas.DataFrame
+        salinity_gL, temp_C, and density_gcm3 for each scenario, indexed by
+        scenario name.
+
+    '''
+    salinity, temp_C = np.meshgrid(salinities, temps, indexing='ij')
+    density, valid = GSL_equation_of_state.salinity_to_density_array(
+        salinity.ravel(), temp_C.ravel())
+    scenarios = pd.DataFrame({
+        'salinity_gL'   : salinity.ravel(),
+        'temp_C'        : temp_C.ravel(),
+        'density_gcm3'  : density})
+    scenarios.index = [str(s) + ' g/L, ' + str(t) + ' C' for s, t
+                       in zip(scenarios['salinity_gL'], scenarios['temp_C'])]
+    return scenarios
+
+
+def depth_sensitivity(data, densities, ref_density,
+                      percentiles=sensitivity_percentiles,
+                      chunk_rows=sensitivity_chunk_rows):
+    '''
+    Calculates water depth for every timestamp and every candidate density
+    (depth = pressure difference / (density * g), as in
+    ResearchModules.calcDepth) and summarizes how much the density
+    assumption changes the calculated depth. The depth matrix is calculated
+    chunk_rows timestamps at a time to limit memory use.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Combined record with pndt_water_pressure_kPa and ws_air_pressure_kPa
+        columns, indexed by time.
+    densities : pandas.Series
+        Candidate densities in g/cm3, indexed by scenario name.
+    ref_density : float
+        Density assumed for the site, in g/cm3. Depth differences are
+        reported relative to the depth calculated with this density.
+    percentiles : list of int, optional
+        Percentiles across scenarios to report for each timestamp. The
+        default is sensitivity_percentiles.
+    chunk_rows : int, optional
+        Number of timestamps to calculate at once. The default is
+        sensitivity_chunk_rows.
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        For each scenario: density, number of depths, mean, stdev, min, and
+        max depth (m), and mean & max absolute difference from the
+        reference depth (m).
+    bands : pandas.DataFrame
+        For each timestamp: the reference depth and the percentiles of
+        depth across scenarios (columns 'p5', 'p25', ...), ready to plot as
+        bands.
+
+    '''
+    # Pressures in N/m2
+    water_Nm2 = ResearchModules.convert_units(
+        data['pndt_water_pressure_kPa'].to_numpy(dtype=float), 'kPa_to_Nm2')
+    air_Nm2 = ResearchModules.convert_units(
+        data['ws_air_pressure_kPa'].to_numpy(dtype=float), 'kPa_to_Nm2')
+    rho = np.asarray(densities, dtype=float)
+    
+    # Running per-scenario totals; depths are summed relative to a typical
+    # depth (shift) so the variance stays accurate
+    shift = np.nanmedian(ResearchModules.calcDepth(
+        water_Nm2, air_Nm2, ref_density))
+    shift = 0 if np.isnan(shift) else shift
+    n = np.zeros(len(rho))
+    depth_sum = np.zeros(len(rho))
+    depth_sumsq = np.zeros(len(rho))
+    diff_sum = np.zeros(len(rho))
+    depth_min = np.full(len(rho), np.inf)
+    depth_max = np.full(len(rho), -np.inf)
+    absdiff_max = np.zeros(len(rho))
+    
+    bands = np.full((len(data), len(percentiles) + 1), np.nan)
+    for start in range(0, len(data), chunk_rows):
+        stop = min(start + chunk_rows, len(data))
+        water = water_Nm2[start:stop, None]
+        air = air_Nm2[start:stop, None]
+        # Depth matrix (timestamps x scenarios) & reference depths
+        depth = ResearchModules.calcDepth(water, air, rho[None,:])
+        ref = ResearchModules.calcDepth(water, air, ref_density)
+        valid = ~np.isnan(depth)
+        diff = np.where(valid, depth - ref, 0)
+        shifted = np.where(valid, depth - shift, 0)
+        n += valid.sum(axis=0)
+        depth_sum += shifted.sum(axis=0)
+        depth_sumsq += (shifted**2).sum(axis=0)
+        diff_sum += diff.sum(axis=0)
+        absdiff_max = np.maximum(absdiff_max, np.abs(diff).max(axis=0))
+        depth_min = np.fmin(depth_min, np.nanmin(
+            np.where(valid, depth, np.inf), axis=0))
+        depth_max = np.fmax(depth_max, np.nanmax(
+            np.where(valid, depth, -np.inf), axis=0))
+        # Percentile bands across scenarios
+        rows = valid.any(axis=1)
+        bands[start:stop, 0] = ref[:,0]
+        bands[start:stop, 1:][rows] = np.nanpercentile(
+            depth[rows], percentiles, axis=1).T
+    
+    # Per-scenario summary
+    with np.errstate(invalid='ignore', divide='ignore'):
+        depth_mean = depth_sum / n
+        depth_std = np.sqrt(np.maximum(
+            (depth_sumsq - depth_sum * depth_mean) / (n - 1), 0))
+        depth_mean = depth_mean + shift
+        diff_mean = diff_sum / n
+    summary = pd.DataFrame({
+        'density_gcm3'      : rho,
+        'n'                 : n.astype(int),
+        'depth_mean_m'      : depth_mean,
+        'depth_stdev_m'     : depth_std,
+        'depth_min_m'       : np.where(n > 0, depth_min, np.nan),
+        'depth_max_m'       : np.where(n > 0, depth_max, np.nan),
+        'diff_mean_m'       : diff_mean,
+        'absdiff_max_m'     : absdiff_max
+        }, index = getattr(densities, 'index', None))
+    bands = pd.DataFrame(
+        bands, index = data.index,
+        columns = ['ref_depth_m'] + ['p' + str(p) for p in percentiles])
+    return summary, bands
+
+
+def run_density_sensitivity(use_eos=False):
+    '''
+    Runs the density sensitivity sweep on each site's combined HOBO file and
+    saves the summary table, percentile bands, and a band plot for each site.
+
+    Parameters
+    ----------
+    use_eos : bool, optional
+        If True, scenarios are salinity & temperature combinations converted
+        to density with the GSL equation of state (see density_scenarios).
+        The default (False) uses the sensitivity_densities values.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if use_eos:
+        scenarios = density_scenarios()
+        densities = scenarios['density_gcm3']
+    else:
+        densities = pd.Series(
+            sensitivity_densities,
+            index = [str(d) + ' g/cm3' for d in sensitivity_densities])
+    directory = os.getcwd()
+    for location in locations:
+        filename, directory, data = ResearchModules.fileGet(
+            'Select ' + location + ' combined HOBO file',
+            tabletype = 'HOBO_comb', directory = directory)
+        data = data.loc[data.index.dropna()]
+        data.index = ResearchModules.parse_timestamps(
+            data.index, label=location + ' timestamps', errors='raise')
+        print('Calculating depth sensitivity for ' + location + '...')
+        summary, bands = depth_sensitivity(
+            data, densities, locations[location]['water_density'])
+        if use_eos:
+            summary = scenarios[['salinity_gL', 'temp_C']].join(summary)
+        prefix = directory + '/' + location.replace(' ','') + '_density_'
+        summary.to_csv(prefix + 'sensitivity_summary.csv')
+        bands.to_csv(prefix + 'sensitivity_bands.csv')
+        
+        # Plot the bands
+        fig, ax = plt.subplots(figsize = (plt_w, plt_ht))
+        p = sensitivity_percentiles
+        for k in range(len(p)//2):
+            ax.fill_between(
+                bands.index, bands['p' + str(p[k])],
+                bands['p' + str(p[-k-1])], color = locations[location]['color'],
+                alpha = 0.2, linewidth = 0,
+                label = str(p[k]) + '-' + str(p[-k-1]) + ' percentile')
+        ax.plot(bands.index, bands['ref_depth_m'], color = 'k', linewidth = 0.5,
+                label = str(locations[location]['water_density']) + ' g/cm3')
+        ax.set_ylabel('Calculated water depth (m)')
+        ax.set_title(location + ' depth sensitivity to density')
+        ax.legend()
+        fig.savefig(prefix + 'sensitivity.png')
+        plt.close(fig)
+
+
 def getPlotInfo(plot):
     lines = [m for m in plotlist[plot] if type(m) == int]
     measlist = [plotlist[plot][line]['title'] for line in lines]
@@ -1171,6 +1375,9 @@ if __name__ == '__main__':
     # Load HOBO files
     # directory, time_min, time_max = loadHOBOFiles()
     
+    # Determine how much the density assumption changes calculated depth
+    # run_density_sensitivity()
+    
     '''These below are now broken.
 
     # Build raw data plots and save HTML file
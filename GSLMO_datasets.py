@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+@project: GSLMO
+
+Catalog of the GSLMO timeseries datasets (logger files, lake elevation,
+weather station data, manual field measurements, and the sheets of the
+compiled timeseries workbook), shared by the timeseries scripts.
+
+Each dataset lists its file, timestamp column and format, and the units of
+its data columns. A DatasetCatalog loads a dataset the first time it is used
+and keeps it, along with every numeric, unit-converted, or resampled column
+that has been asked for, so a script only reads the files it uses and
+converts each column once:
+
+    catalog = GSLMO_datasets.DatasetCatalog()
+    temp_C = catalog.series('site_A_butt_A', 'T_F', 'F_to_C')
+
+Unit conversions are the names in ResearchModules.unit_conversions.
+
+"""
+
+####################
+# IMPORTS
+####################
+import ResearchModules
+import os
+import pandas as pd
+
+
+####################
+# VARIABLES
+####################
+# Directory where the dataset files are stored
+data_dir = (
+    'G:/My Drive/Teaching, Research, Etc/Research/Great Salt Lake/' +
+    '2022 Microbialite Desiccation Bio Paper/Timeseries Field & Logger Data')
+
+# Datasets
+datasets = {
+    'elevation_Saltair': {
+        'title'     : 'Elevation at Saltair (USGS)',
+        'fname'     : 'Elev_Saltair_071001-220925.csv',
+        'xcol'      : '20d',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'14n' : 'ft asl', 'm' : 'm asl'}
+        },
+    'elevation_Causeway': {
+        'title'     : 'Elevation S of RR causeway near Lakeside (USGS)',
+        'fname'     : 'Elev_Causeway_191028-221027.csv',
+        'xcol'      : '20d',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'14n' : 'ft asl', 'm' : 'm asl'}
+        },
+    'site_A_pend': {
+        'title'     : 'Site A Pendant',
+        # !! Same file as site_B_pend; check whether this should be
+        # SiteA_Pendant_combined_QC.csv
+        'fname'     : 'SiteB_Pendant_combined_QC.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'T_C' : 'degC', 'P_abs' : 'in Hg'}
+        },
+    'site_A_butt_A': {
+        'title'     : 'Site A Button A (top)',
+        'fname'     : 'SiteA_ButtonA_combined_QC.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'T_F' : 'degF', 'lumen_sqft' : 'lumen/ft2'}
+        },
+    'site_B_pend': {
+        'title'     : 'Site B Pendant',
+        'fname'     : 'SiteB_Pendant_combined_QC.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'T_C' : 'degC', 'P_abs' : 'in Hg'}
+        },
+    'site_B_butt_B': {
+        'title'     : 'Site B Button B (top)',
+        'fname'     : 'SiteB_ButtonB_combined_QC.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'T_F' : 'degF', 'lumen_sqft' : 'lumen/ft2'}
+        },
+    'site_B_butt_C': {
+        'title'     : 'Site B Button C (side)',
+        'fname'     : 'SiteB_ButtonC_combined_QC.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'T_F' : 'degF', 'lumen_sqft' : 'lumen/ft2'}
+        },
+    'manual_data': {
+        'title'     : 'Manual field measurements',
+        'fname'     : 'field_monitoring_data_fmttd_B.csv',
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {
+            'water_depth_m'                 : 'm',
+            'T_top_C'                       : 'degC',
+            'T_mid_C'                       : 'degC',
+            'T_bot_C'                       : 'degC',
+            'Water surface.5'               : '% salinity',
+            'Mid (if diff. from max vis).4' : '% salinity',
+            'Max visible depth.5'           : '% salinity',
+            'Sed/water interface.5'         : '% salinity'
+            }
+        },
+    'site_depths': {
+        'title'     : 'Calculated field site depths (merge_depths.py)',
+        'fname'     : 'daily_site_depth_calc.csv',
+        'xcol'      : '20d',
+        'datefmt'   : '%m/%d/%Y',
+        'units'     : {'depth_B' : 'm', 'depth_B3' : 'm'}
+        },
+    'KUTSYRAC22': {
+        'title'     : 'KUTSYRAC22 weather station data',
+        'fname'     : 'KUTSYRAC22_190301-201122.csv',
+        'xcol'      : 'Time',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'Temperature (F)' : 'degF',
+                       'Precip. Accum. (in)' : 'in'}
+        },
+    'KUTSYRAC27': {
+        'title'     : 'KUTSYRAC27 weather station data',
+        'fname'     : 'KUTSYRAC27_200901-221106.csv',
+        'xcol'      : 'Time',
+        'datefmt'   : '%m/%d/%Y %H:%M',
+        'units'     : {'Temperature (F)' : 'degF',
+                       'Precip. Accum. (in)' : 'in'}
+        }
+    }
+
+# Workbook sheets are read from parquet copies saved in this folder (next to
+# the workbook) until the workbook is changed
+cache_sheets = True
+sheet_cache_folder = 'xlsx_cache'
+
+# Sheets of the compiled timeseries workbook, added to the datasets as
+# 'workbook_SHEET' (header row of each sheet, data column units)
+workbook_fname = 'timeseries-data.xlsx'
+workbook_sheets = {
+    'GSL_elevation_Saltair'     : (3, {'Elevation (m)' : 'm asl'}),
+    'GSL_elevation_Causeway'    : (3, {'Elevation (m)' : 'm asl'}),
+    'HOBO_pendant'              : (3, {'Temperature (°C)' : 'degC'}),
+    'HOBO_button_top'           : (3, {'Temperature (°C)' : 'degC',
+                                       'Irradiance (lux)' : 'lux'}),
+    'HOBO_button_side'          : (3, {'Temperature (°C)' : 'degC'}),
+    'KUTSYRAC22'                : (2, {'Precip. Accum (cm)' : 'cm'}),
+    'KUTSYRAC27'                : (2, {'Precip. Accum (cm)' : 'cm'})
+    }
+for sheet in workbook_sheets:
+    datasets['workbook_' + sheet] = {
+        'title'     : 'Timeseries workbook sheet ' + sheet,
+        'fname'     : workbook_fname,
+        'sheet'     : sheet,
+        'header'    : workbook_sheets[sheet][0],
+        'xcol'      : 'Datetime',
+        'datefmt'   : '%Y-%m-%d %H:%M:%S',
+        'units'     : workbook_sheets[sheet][1]
+        }
+
+
+####################
+# FUNCTIONS
+####################
+
+def sheet_cache_file(path, sheet):
+    '''Returns the path of the parquet copy of a workbook sheet. The name
+    includes the workbook modification time, so editing the workbook makes
+    the old copies stale.'''
+    base = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(
+        os.path.dirname(path), sheet_cache_folder,
+        base + '_' + sheet + '_' + str(os.stat(path).st_mtime_ns) + '.parquet')
+
+
+def save_sheet_cache(path, sheet, data):
+    '''Saves the parquet copy of a workbook sheet, deleting stale copies'''
+    cache_file = sheet_cache_file(path, sheet)
+    folder = os.path.dirname(cache_file)
+    os.makedirs(folder, exist_ok=True)
+    prefix = os.path.basename(cache_file).rsplit('_', 1)[0]
+    for old_file in os.listdir(folder):
+        if old_file.rsplit('_', 1)[0] == prefix:
+            os.remove(os.path.join(folder, old_file))
+    data.to_parquet(cache_file, index=False)
+
+
+def read_workbook_sheets(path, sheet_headers, use_cache=cache_sheets):
+    '''
+    Reads sheets of an Excel workbook. Sheets with an up-to-date parquet copy
+    are read from it; the rest are read from the workbook, opened once for
+    all of them, and saved as parquet copies for the next run.
+
+    Parameters
+    ----------
+    path : str
+        Path of the workbook.
+    sheet_headers : dict
+        {sheet name : header row}
+    use_cache : bool, optional
+        Whether to use and save parquet copies. The default is cache_sheets.
+
+    Returns
+    -------
+    tables : dict
+        {sheet name : pandas.DataFrame}
+
+    '''
+    tables = {}
+    missing = {}
+    for sheet in sheet_headers:
+        cache_file = sheet_cache_file(path, sheet)
+        if use_cache and os.path.exists(cache_file):
+            tables[sheet] = pd.read_parquet(cache_file)
+        else:
+            missing[sheet] = sheet_headers[sheet]
+
+    if missing:
+        print('Reading ' + str(len(missing)) + ' sheet(s) from ' + path
+              + '...')
+        with pd.ExcelFile(path) as workbook:
+            for sheet in missing:
+                data = workbook.parse(sheet, header = missing[sheet])
+                # Parquet needs text column names & one type per column
+                data.columns = data.columns.map(str)
+                for col in data.columns[data.dtypes == object]:
+                    data[col] = data[col].astype('string')
+                tables[sheet] = data
+                if use_cache:
+                    try:
+                        save_sheet_cache(path, sheet, data)
+                    except ImportError:
+                        print('   Install pyarrow to cache workbook sheets.')
+                        use_cache = False
+    return tables
+
+
+class DatasetCatalog:
+    '''
+    Loads datasets from the catalog on first use and keeps them for the
+    session, along with each column that has been converted.
+
+    Parameters
+    ----------
+    data_dir : str, optional
+        Directory containing the dataset files. The default is data_dir.
+    ask : bool, optional
+        Whether to ask the user to select each file (otherwise a file is only
+        asked for if it isn't found in data_dir). Datasets that share a file
+        (the workbook sheets) are only asked for once. The default is False.
+    catalog : dict, optional
+        Dataset descriptions. The default is datasets.
+    '''
+    def __init__(self, data_dir=data_dir, ask=False, catalog=datasets):
+        self.datasets = catalog
+        self.data_dir = data_dir
+        self.ask = ask
+        self.paths = {}
+        self.tables = {}
+        self.columns = {}
+
+    def find_file(self, name):
+        '''Returns the path of a dataset's file, asking for it if needed'''
+        if name in self.paths:
+            return self.paths[name]
+        info = self.datasets[name]
+        shared = [self.paths[other] for other in self.paths
+                  if self.datasets[other]['fname'] == info['fname']]
+        path = os.path.join(self.data_dir, info['fname'])
+        if shared:
+            path = shared[0]
+        elif self.ask or not os.path.exists(path):
+            if 'sheet' in info:
+                file_type = [('Excel', '*.xls *.xlsx')]
+            else:
+                file_type = [('CSV', '*.csv')]
+            filelist, self.data_dir = ResearchModules.getFiles(
+                'Select file with data for ' + info['title'],
+                directory = self.data_dir, file_type = file_type)
+            path = filelist[0]
+        self.paths[name] = path
+        return path
+
+    def load(self, name):
+        '''
+        Returns a dataset's table, indexed by timestamp (loaded and parsed
+        on first use). Rows without a valid timestamp are dropped.
+        '''
+        if name not in self.tables:
+            info = self.datasets[name]
+            path = self.find_file(name)
+            print('Loading ' + name + ' from ' + path + '...')
+            if 'sheet' in info:
+                # Convert all of the catalog's sheets in the workbook at once
+                sheets = {
+                    self.datasets[other]['sheet'] :
+                        self.datasets[other].get('header', 0)
+                    for other in self.datasets
+                    if 'sheet' in self.datasets[other]
+                    and self.datasets[other]['fname'] == info['fname']}
+                data = read_workbook_sheets(path, sheets)[info['sheet']]
+            else:
+                data = pd.read_csv(path, header = info.get('header', 0))
+            if info['xcol'] not in data.columns:
+                data = data.reset_index()
+            data.index = ResearchModules.parse_timestamps(
+                data[info['xcol']], info['datefmt'], name)
+            self.tables[name] = data[data.index.notna()]
+        return self.tables[name]
+
+    def series(self, name, col, conv='none', resample=None):
+        '''
+        Returns one data column of a dataset as numbers, converted to other
+        units and resampled (mean) if specified. Each combination is
+        calculated once and kept.
+
+        Parameters
+        ----------
+        name : str
+            Dataset name.
+        col : str
+            Data column.
+        conv : str or list of str, optional
+            Unit conversion(s) (see ResearchModules.convert_units).
+            The default is 'none'.
+        resample : str, optional
+            Interval to average the data to (e.g., '1h'). The default is None.
+
+        Returns
+        -------
+        series : pandas.Series
+            The column, indexed by timestamp. Treat it as read-only: it is
+            shared with every other request for the same column.
+
+        '''
+        if isinstance(conv, list):
+            conv = tuple(conv)
+        if conv in ('', None):
+            conv = 'none'
+        key = (name, col, conv, resample)
+        if key not in self.columns:
+            if resample:
+                series = self.series(name, col, conv).resample(
+                    resample).mean()
+            elif conv != 'none':
+                series = ResearchModules.convert_units(
+                    self.series(name, col), list(conv) if isinstance(
+                        conv, tuple) else conv)
+            else:
+                series = pd.to_numeric(
+                    self.load(name)[col], errors='coerce').astype(float)
+            self.columns[key] = series
+        return self.columns[key]
+
+    def clear(self):
+        '''Forgets the loaded datasets and converted columns'''
+        self.tables = {}
+        self.columns = {}
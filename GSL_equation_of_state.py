@@ -10,6 +10,21 @@ using the equation of state developed by Naftz et al (2011).
 
 The equation of state is valid from 0-270 g/L salinity.
 
+The *_array functions accept numbers, lists, numpy arrays, or pandas Series
+(salinity/density and temperature are broadcast against each other) and
+return numpy arrays along with a mask of which values are within the valid
+range. One warning is printed per call, counting the out-of-range values.
+Run this script to benchmark the array functions against looping over the
+single-value functions.
+
+Pass method='table' to the *_array functions to interpolate from precomputed
+lookup tables (bilinear interpolation on a salinity/density × temperature
+grid, with a max error under 0.001 g/L) instead of solving the equation of
+state for each value. Tables are built on first use, or can be saved with
+save_lookup_table and loaded with load_lookup_table. Values outside a table
+are calculated exactly. With numpy, the exact array functions are about as
+fast as the tables; run the benchmark to compare on your machine.
+
 References:
     
     Naftz, D. L., Millero, F. J., Jones, B. F., & Green, W. R. (2011). An
@@ -42,7 +57,8 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>
 ###############
 # IMPORTS
 ###############
-import math
+import time
+import numpy as np
 
 
 ###############
@@ -62,6 +78,16 @@ lim_max = 270   # Upper validity limit in g/L
 warn_start = 'Warning: The '
 warn_mid = ' is outside the range of 0–270 g/L used to develop the GSL equation of state in Naftz (2011). Take this calculated '
 warn_end = ' value with a grain of salt. Pun fully intended.'
+# Lookup table grids: (start, stop, step) for each axis
+table_grids = {
+    'salinity'      : (0, 300, 1),      # g/L
+    'temperature'   : (-5, 40, 0.5),    # degrees C
+    'density'       : (None, None, 0.001) # g/cm3; range set by the other two
+    }
+lookup_tables = {} # Tables in use, by direction (built on first use)
+
+warn_mid_array = (' outside the range of 0–270 g/L used to develop the GSL '
+                  'equation of state in Naftz (2011). Take these calculated ')
 
 
 ###############
@@ -97,6 +123,332 @@ def water_density(temp_C):
     return density
 
 
+def valid_salinity(salinity):
+    '''Returns a mask of salinity values within the valid range'''
+    return (salinity >= 0) & (salinity <= lim_max)
+
+
+def warn_range(valid, value_name, result_name, missing=False):
+    '''
+    Prints one warning for the values outside the valid range. Missing
+    inputs are not counted as out of range.
+
+    Parameters
+    ----------
+    valid : numpy.ndarray of bool
+        Validity mask.
+    value_name : str
+        Name of the checked values, e.g., 'salinity input'.
+    result_name : str
+        Name of the calculated values, e.g., 'density'.
+    missing : numpy.ndarray of bool, optional
+        Mask of missing (NaN) inputs. The default is False.
+
+    Returns
+    -------
+    None.
+
+    '''
+    n_invalid = int(np.count_nonzero(~valid & ~missing))
+    if not n_invalid:
+        return
+    if np.size(valid) == 1:
+        print(warn_start + value_name + warn_mid + result_name + warn_end)
+    else:
+        print('Warning: ' + str(n_invalid) + ' of ' + str(np.size(valid))
+              + ' ' + value_name + ' values are' + warn_mid_array
+              + result_name + ' values with a grain of salt.'
+              + ' Pun fully intended.')
+
+
+def salinity_to_density_array(salinity, temp_C, warn=True, method='exact'):
+    '''
+    Determines water density from measured salinity for arrays of values
+
+    Parameters
+    ----------
+    salinity : float or array-like
+        Measured conductivity salinity (in g/L) of GSL samples.
+    temp_C : float or array-like
+        Temperature at which salinity was measured in degrees C.
+    warn : bool, optional
+        Print a warning if any salinity is out of range. The default is True.
+    method : str, optional
+        'exact' (default) solves the equation of state; 'table' interpolates
+        from the salinity_to_density lookup table.
+
+    Returns
+    -------
+    density_gcm3 : numpy.ndarray
+        Calculated water density in g/cm3.
+    valid : numpy.ndarray of bool
+        True where the salinity is within the valid range.
+
+    '''
+    salinity, temp_C = np.broadcast_arrays(
+        np.asarray(salinity, dtype=float), np.asarray(temp_C, dtype=float))
+    if method == 'table':
+        density_gcm3 = lookup(
+            get_lookup_table('salinity_to_density'), salinity, temp_C)
+    else:
+        T_K = C_to_K(temp_C)
+        p0 = water_density(temp_C)
+        density_kgm3 = (p0*1000 + A + B*salinity + C*T_K + D*salinity**2
+                        + E*T_K**2 + F*salinity*T_K)
+        density_gcm3 = density_kgm3/1000
+    valid = valid_salinity(salinity)
+    if warn:
+        warn_range(valid, 'salinity input', 'density',
+                   np.isnan(salinity) | np.isnan(temp_C))
+    return density_gcm3, valid
+
+
+def density_to_salinity_array(density, temp_C, warn=True, method='exact'):
+    '''
+    Determines salinity from measured water density for arrays of values
+
+    Parameters
+    ----------
+    density : float or array-like
+        Density of the water measured in g/cm3.
+    temp_C : float or array-like
+        Temperature at which density was measured in degrees C.
+    warn : bool, optional
+        Print a warning if any salinity is out of range. The default is True.
+    method : str, optional
+        'exact' (default) solves the equation of state; 'table' interpolates
+        from the density_to_salinity lookup table.
+
+    Returns
+    -------
+    salinity : numpy.ndarray
+        Calculated salinity result in g/L (NaN if there is no solution).
+    valid : numpy.ndarray of bool
+        True where the calculated salinity is within the valid range.
+
+    '''
+    density, temp_C = np.broadcast_arrays(
+        np.asarray(density, dtype=float), np.asarray(temp_C, dtype=float))
+    
+    if method == 'table':
+        salinity = lookup(
+            get_lookup_table('density_to_salinity'), density, temp_C)
+    else:
+        # Convert temperature
+        T_K = C_to_K(temp_C)
+        
+        # Calculate density of pure water
+        p0 = water_density(temp_C)
+        
+        # Calculate variables
+        G = B + F*T_K
+        H = A + C*T_K + E*T_K**2 - (density-p0)*1000
+        
+        with np.errstate(invalid='ignore'):
+            salinity = (-G + np.sqrt(G**2 - 4*D*H)) /(2*D)
+    
+    valid = valid_salinity(salinity)
+    if warn:
+        warn_range(valid, 'calculated salinity', 'salinity',
+                   np.isnan(density) | np.isnan(temp_C))
+    return salinity, valid
+
+
+def salinity_to_salinityWtPct_array(salinity, temp_C, warn=True,
+                                    method='exact'):
+    '''
+    Convert salinity in g/L to wt % salinity for arrays of values
+    
+    Parameters
+    ----------
+    salinity : float or array-like
+        Salinity measured in g/L
+    temp_C : float or array-like
+        Temperature at which salinity was measured in degrees C.
+    warn : bool, optional
+        Print a warning if any salinity is out of range. The default is True.
+    method : str, optional
+        'exact' (default) or 'table'; see salinity_to_density_array.
+        
+    Returns
+    -------
+    salinity_pct : numpy.ndarray
+        Calculated salinity in weight %
+    valid : numpy.ndarray of bool
+        True where the salinity is within the valid range.
+        
+    '''
+    # Calculate density of GSL water
+    density_GSL, valid = salinity_to_density_array(
+        salinity, temp_C, warn, method)
+    
+    # Determine weight percent
+    # = salinity in g/L divided by density in g/cm3 * 100/1000
+    salinity_pct = np.round(np.asarray(salinity)/(density_GSL * 10),1)
+    
+    return salinity_pct, valid
+
+
+def build_lookup_table(direction):
+    '''
+    Builds a lookup table for one direction of the equation of state on the
+    table_grids grid and measures its maximum error.
+
+    Parameters
+    ----------
+    direction : str
+        'salinity_to_density' or 'density_to_salinity'.
+
+    Returns
+    -------
+    table : dict
+        'direction'; 'x0', 'dx' (start & step of the salinity or density
+        axis); 't0', 'dt' (start & step of the temperature axis); 'values'
+        (2-D array, x by temperature); and 'max_error' (max absolute error
+        against the exact equation, in g/cm3 or g/L).
+
+    '''
+    t0, t1, dt = table_grids['temperature']
+    if direction == 'salinity_to_density':
+        x0, x1, dx = table_grids['salinity']
+        exact = salinity_to_density_array
+    else:
+        s0, s1, ds = table_grids['salinity']
+        x0, x1, dx = table_grids['density']
+        # Cover the densities of the salinity & temperature range, plus a step
+        x0 = np.floor(salinity_to_density_array(s0, t1, False)[0]/dx - 1)*dx
+        x1 = np.ceil(salinity_to_density_array(s1, t0, False)[0]/dx + 1)*dx
+        exact = density_to_salinity_array
+    x = x0 + dx*np.arange(round((x1 - x0)/dx) + 1)
+    t = t0 + dt*np.arange(round((t1 - t0)/dt) + 1)
+    table = {
+        'direction' : direction,
+        'x0'        : x[0],
+        'dx'        : dx,
+        't0'        : t[0],
+        'dt'        : dt,
+        'values'    : exact(x[:,None], t[None,:], False)[0]
+        }
+    table['max_error'] = lookup_table_error(table)
+    return table
+
+
+def lookup(table, x, temp_C):
+    '''
+    Bilinear interpolation from a lookup table. Points outside the table
+    are calculated with the exact equation; missing (NaN) inputs give NaN.
+
+    Parameters
+    ----------
+    table : dict
+        Lookup table from build_lookup_table or load_lookup_table.
+    x : numpy.ndarray
+        Salinity (g/L) or density (g/cm3) values, depending on the table.
+    temp_C : numpy.ndarray
+        Temperatures in degrees C, same shape as x.
+
+    Returns
+    -------
+    result : numpy.ndarray
+        Interpolated values.
+
+    '''
+    values = table['values']
+    nx, nt = values.shape
+    # Bilinear coefficients of each grid cell, so one lookup gets all four
+    if 'coefs' not in table:
+        table['coefs'] = np.stack([
+            values[:-1,:-1],
+            values[1:,:-1] - values[:-1,:-1],
+            values[:-1,1:] - values[:-1,:-1],
+            values[1:,1:] - values[1:,:-1] - values[:-1,1:] + values[:-1,:-1]
+            ], axis=-1).reshape(-1, 4)
+    # Fractional grid positions (uniform grid, so no search is needed)
+    fx = (x - table['x0']) / table['dx']
+    ft = (temp_C - table['t0']) / table['dt']
+    finite = np.isfinite(fx) & np.isfinite(ft)
+    inside = finite & (fx >= 0) & (fx <= nx-1) & (ft >= 0) & (ft <= nt-1)
+    # Index only the points inside the table (NaN can't be cast to an index)
+    fx = np.where(inside, fx, 0)
+    ft = np.where(inside, ft, 0)
+    i = np.clip(fx, 0, nx-2).astype(np.intp)
+    j = np.clip(ft, 0, nt-2).astype(np.intp)
+    a = fx - i
+    b = ft - j
+    c = table['coefs'][i*(nt-1) + j]
+    result = c[...,0] + c[...,1]*a + c[...,2]*b + c[...,3]*a*b
+    result[~finite] = np.nan
+    outside = finite & ~inside
+    if outside.any():
+        exact = (salinity_to_density_array
+                 if table['direction'] == 'salinity_to_density'
+                 else density_to_salinity_array)
+        result[outside] = exact(x[outside], temp_C[outside], False)[0]
+    return result
+
+
+def lookup_table_error(table, n=1000000, seed=0):
+    '''
+    Returns the maximum absolute error of a lookup table against the exact
+    equation, checked at cell midpoints and n random points in the table.
+    '''
+    rng = np.random.default_rng(seed)
+    nx, nt = table['values'].shape
+    # Cell midpoints (the largest bilinear errors are near them) & random
+    fx = np.concatenate([
+        np.repeat(np.arange(nx-1) + 0.5, nt-1), rng.uniform(0, nx-1, n)])
+    ft = np.concatenate([
+        np.tile(np.arange(nt-1) + 0.5, nx-1), rng.uniform(0, nt-1, n)])
+    x = table['x0'] + fx*table['dx']
+    temp_C = table['t0'] + ft*table['dt']
+    exact = (salinity_to_density_array
+             if table['direction'] == 'salinity_to_density'
+             else density_to_salinity_array)
+    return float(np.nanmax(np.abs(
+        lookup(table, x, temp_C) - exact(x, temp_C, False)[0])))
+
+
+def get_lookup_table(direction):
+    '''Returns the lookup table in use for a direction, building it first
+    if there isn't one'''
+    if direction not in lookup_tables:
+        lookup_tables[direction] = build_lookup_table(direction)
+    return lookup_tables[direction]
+
+
+def save_lookup_table(table, filename):
+    '''Saves a lookup table to a .npz file'''
+    np.savez_compressed(filename, **{
+        key : table[key] for key in table if key != 'coefs'})
+
+
+def load_lookup_table(filename, use=True):
+    '''
+    Loads a lookup table saved with save_lookup_table.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the .npz file.
+    use : bool, optional
+        Use the table for method='table' conversions. The default is True.
+
+    Returns
+    -------
+    table : dict
+        Lookup table.
+
+    '''
+    with np.load(filename) as file:
+        table = {key : file[key][()] for key in file.files}
+    table['direction'] = str(table['direction'])
+    if use:
+        lookup_tables[table['direction']] = table
+    print('Loaded ' + table['direction'] + ' lookup table (max error '
+          + str(table['max_error']) + ').')
+    return table
+
+
 def salinity_to_density(salinity, temp_C):
     '''
     Determines water density from measured salinity
@@ -110,17 +462,12 @@ def salinity_to_density(salinity, temp_C):
 
     Returns
     -------
-    density_gcm3 : TYPE
+    density_gcm3 : float
         Calculated water density in g/cm3.
 
     '''
-    T_K = C_to_K(temp_C)
-    p0 = water_density(temp_C)
-    density_kgm3 = p0*1000 + A + B*salinity + C*T_K + D*salinity**2 + E*T_K**2 + F*salinity*T_K
-    density_gcm3 = density_kgm3/1000
-    if salinity < 0 or salinity > lim_max:
-        print(warn_start + 'salinity input' + warn_mid + 'density' + warn_end)
-    return density_gcm3
+    density_gcm3, valid = salinity_to_density_array(salinity, temp_C)
+    return density_gcm3[()]
 
 
 def density_to_salinity(density, temp_C):
@@ -140,24 +487,8 @@ def density_to_salinity(density, temp_C):
         Calculated salinity result in g/L
 
     '''
-    
-    # Convert temperature
-    T_K = C_to_K(temp_C)
-    
-    # Calculate density of pure water
-    p0 = water_density(temp_C)
-    
-    # Calculate variables
-    G = B + F*T_K
-    H = A + C*T_K + E*T_K**2 - (density-p0)*1000
-    
-    salinity = (-G + math.sqrt(G**2 - 4*D*H)) /(2*D)
-    
-    if salinity < 0 or salinity > lim_max:
-        print(warn_start + 'calculated salinity value' + warn_mid + 'salinity'
-              + warn_end)
-    
-    return salinity
+    salinity, valid = density_to_salinity_array(density, temp_C)
+    return salinity[()]
 
 
 def salinity_to_salinityWtPct(salinity, temp_C):
@@ -177,13 +508,88 @@ def salinity_to_salinityWtPct(salinity, temp_C):
         Calculated salinity in weight %
         
     '''
-    
-    # Calculate density of GSL water
-    density_GSL = salinity_to_density(salinity, temp_C)
-    
-    # Determine weight percent
-    # = salinity in g/L divided by density in g/cm3 * 100/1000
-    salinity_pct = round(salinity/(density_GSL * 10),1)
-    
-    return salinity_pct
-    
\ No newline at end of file
+    salinity_pct, valid = salinity_to_salinityWtPct_array(salinity, temp_C)
+    return salinity_pct[()]
+
+
+def benchmark(n=100000, repeats=3):
+    '''
+    Times the array functions (exact & lookup table methods) against looping
+    over the single-value functions on n random salinity/density &
+    temperature values, and checks how much their results differ.
+
+    Parameters
+    ----------
+    n : int, optional
+        Number of values. The default is 100000.
+    repeats : int, optional
+        Number of timed passes; the fastest is kept. The default is 3.
+
+    Returns
+    -------
+    results : dict
+        {function : {'loop_s', 'array_s', 'table_s', 'speedup', 'max_diff',
+                     'table_diff', 'nan_match'}}
+
+    '''
+    rng = np.random.default_rng(0)
+    salinity = rng.uniform(50, 260, n)
+    temp_C = rng.uniform(0, 35, n)
+    density, valid = salinity_to_density_array(salinity, temp_C)
+    # Include missing values (e.g., logger gaps) in the checks
+    salinity[:2] = [150, np.nan]
+    density[:2] = [1.1, np.nan]
+    temp_C[:2] = [np.nan, 20]
+    inputs = {
+        'salinity_to_density'       : (salinity, salinity_to_density,
+                                       salinity_to_density_array),
+        'density_to_salinity'       : (density, density_to_salinity,
+                                       density_to_salinity_array),
+        'salinity_to_salinityWtPct' : (salinity, salinity_to_salinityWtPct,
+                                       salinity_to_salinityWtPct_array)
+        }
+    results = {}
+    for name, (values, scalar_fn, array_fn) in inputs.items():
+        # Build the lookup table before timing
+        array_fn(values[:1], temp_C[:1], False, 'table')
+        loop_s = array_s = table_s = float('inf')
+        for r in range(repeats):
+            t0 = time.perf_counter()
+            loop_result = np.array(
+                [scalar_fn(v, t) for v, t in zip(values, temp_C)])
+            loop_s = min(loop_s, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            array_result, valid = array_fn(values, temp_C)
+            array_s = min(array_s, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            table_result, valid = array_fn(values, temp_C, method='table')
+            table_s = min(table_s, time.perf_counter() - t0)
+        results[name] = {
+            'loop_s'    : loop_s,
+            'array_s'   : array_s,
+            'table_s'   : table_s,
+            'speedup'   : loop_s / array_s,
+            'max_diff'  : float(np.nanmax(np.abs(loop_result - array_result))),
+            'table_diff': float(np.nanmax(np.abs(loop_result - table_result))),
+            'nan_match' : bool(np.array_equal(np.isnan(loop_result),
+                                              np.isnan(table_result)))
+            }
+        print(name + ': loop ' + str(round(loop_s, 3)) + ' s, array '
+              + str(round(array_s, 5)) + ' s ('
+              + str(round(results[name]['speedup'])) + 'x faster), max diff '
+              + str(results[name]['max_diff']) + '; table '
+              + str(round(table_s, 5)) + ' s, max diff '
+              + str(results[name]['table_diff']) + ', NaN where exact is NaN: '
+              + str(results[name]['nan_match']))
+    return results
+
+
+#%%
+###############
+# MAIN
+###############
+if __name__ == '__main__':
+    benchmark()
+    for direction in ['salinity_to_density', 'density_to_salinity']:
+        print(direction + ' lookup table max error: '
+              + str(get_lookup_table(direction)['max_error']))
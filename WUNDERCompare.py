@@ -6,9 +6,12 @@ Created on Wed Jun 30 10:57:22 2021
 """
 
 import ResearchModules
+import WUNDERScrape
 import os
+import hashlib
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from bokeh.io import show
 from bokeh.layouts import column
 from bokeh.plotting import figure, output_file, save
@@ -34,24 +37,13 @@ WUNDERCompare.py</a>.</p>
 '''
 station_html = ''
 
-# Unit conversion functions
-def f_to_c(temperature_in_F):
-    ''' Convert temperature in Farenheit to Celsius '''
-    return round((temperature_in_F-32) * 5/9,1)
-
-def mph_to_mps(mph):
-    ''' Convert velocity in miles per hour to meters per second '''
-    return round(mph*1609.34/60,1)
-
-def in_to_mm(inches):
-    ''' Convert inches to mm '''
-    return round(inches * 25.4, 0)
-    
-
 # Measurement map
+# 'convert' is a conversion name from ResearchModules.unit_conversions
+# (False for none), 'decimals' is the number of decimals to round to
 measlist = {
     'Temperature'   : {
-        'convert'   : f_to_c,
+        'convert'   : 'F_to_C',
+        'decimals'  : 1,
         'title'     : 'Temperature',
         'unit'      : 'C'
         },
@@ -61,27 +53,32 @@ measlist = {
         'unit'      : '%'
         },
     'Speed'         : {
-        'convert'   : mph_to_mps,
+        'convert'   : 'mph_to_mps',
+        'decimals'  : 1,
         'title'     : 'Wind Speed',
         'unit'      : 'mps'
         },
     'Gust'          : {
-        'convert'   : mph_to_mps,
+        'convert'   : 'mph_to_mps',
+        'decimals'  : 1,
         'title'     : 'Wind Gust',
         'unit'      : 'mps'
         },
     'Pressure'      : {
-        'convert'   : in_to_mm,
+        'convert'   : 'inch_to_mm',
+        'decimals'  : 0,
         'title'     : 'Pressure',
         'unit'      : 'mm'
         },
     'Precip. Rate.' : {
-        'convert'   : in_to_mm,
+        'convert'   : 'inch_to_mm',
+        'decimals'  : 0,
         'title'     : 'Precip. Rate',
         'unit'      : 'mm'
         },
     'Precip. Accum.': {
-        'convert'   : in_to_mm,
+        'convert'   : 'inch_to_mm',
+        'decimals'  : 0,
         'title'     : 'Precip. Accum.',
         'unit'      : 'mm'
         },
@@ -98,6 +95,137 @@ measlist = {
     }
 
 
+# Aggregate cache
+# Hourly & daily aggregates for each station file are saved in this folder
+# (in the station file directory), named by the hash of the station file, so
+# they are only rebuilt when a station file changes. Change agg_version if
+# the way aggregates are calculated changes.
+agg_folder = 'wu_aggregates'
+agg_version = '1'
+interp_limit = 20 # Max minutes of missing data to interpolate over
+max_workers = None # Number of stations to aggregate at once (None = # CPUs)
+
+
+def file_hash(file):
+    '''
+    Returns the SHA-1 hash of a station file's contents (and of the
+    aggregate settings). For parquet station directories, all of the part
+    files are hashed.
+    '''
+    digest = hashlib.sha1(agg_version.encode())
+    if os.path.isdir(file):
+        parts = sorted(os.path.join(file, part) for part in os.listdir(file))
+    else:
+        parts = [file]
+    for part in parts:
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(1<<20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def station_name(file):
+    '''Returns the station code from a station file name'''
+    return os.path.splitext(file.rsplit('wu_')[1])[0]
+
+
+def build_aggregates(file):
+    '''
+    Loads a station file and calculates smoothed hourly values and daily
+    min/max values for every measurement, in measlist units.
+
+    Parameters
+    ----------
+    file : str
+        Station file (wu_STATION.csv or wu_STATION.parquet).
+
+    Returns
+    -------
+    hourly : pandas.DataFrame
+        Hourly values of each measurement, indexed by time.
+    daily : pandas.DataFrame
+        Daily min & max of each measurement ('MEASUREMENT min',
+        'MEASUREMENT max'), indexed by date.
+
+    '''
+    data = WUNDERScrape.load_station_file(file)
+    # Determine which measurements are present
+    columns = list(data.columns)
+    colmap = {}
+    for meas in measlist:
+        col = [idx for idx, s in enumerate(columns) if meas in s]
+        colmap[columns[col[0]]] = meas
+    data.rename(columns = colmap, inplace=True)
+    # Convert measurement units, all columns at once
+    data_converted = data[list(measlist)].copy()
+    conversions = {
+        measurement : measlist[measurement]['convert']
+        for measurement in measlist if measlist[measurement]['convert']}
+    ResearchModules.convert_columns(data_converted, conversions)
+    data_converted = data_converted.round(
+        {measurement : measlist[measurement]['decimals']
+         for measurement in conversions})
+    data_converted.index = data['Time']
+    data_converted = data_converted[~data_converted.index.duplicated()]
+    # Generate smoothed hourly data for all measurements at once
+    hourly = data_converted.resample('1min').interpolate(
+        'index', limit = interp_limit, limit_area = 'inside').resample(
+            'h').asfreq()
+    # Find daily min/max values
+    daily = hourly.resample('D').agg(['min','max'])
+    daily.columns = [' '.join(col) for col in daily.columns]
+    return hourly, daily
+
+
+def cached_aggregates(file):
+    '''
+    Returns the aggregate files for a station file, building them first if
+    there are none for the current contents of the station file.
+
+    Returns
+    -------
+    station : str
+        Station code.
+    agg_files : dict
+        {'hourly' : file path, 'daily' : file path}
+
+    '''
+    station = station_name(file)
+    agg_dir = os.path.join(os.path.dirname(file), agg_folder)
+    key = file_hash(file)
+    prefix = os.path.basename(file) + '_'
+    agg_files = {
+        agg : os.path.join(agg_dir, prefix + key + '_' + agg + '.parquet')
+        for agg in ['hourly', 'daily']}
+    if not all(os.path.isfile(f) for f in agg_files.values()):
+        print('Building aggregates for Station ' + station + '...')
+        os.makedirs(agg_dir, exist_ok=True)
+        # Remove aggregates built from older versions of the file
+        for f in os.listdir(agg_dir):
+            if f.startswith(prefix):
+                os.remove(os.path.join(agg_dir, f))
+        for agg, data in zip(agg_files, build_aggregates(file)):
+            data.to_parquet(agg_files[agg])
+    return station, agg_files
+
+
+def load_daily_aggregates(filelist, workers=max_workers):
+    '''
+    Loads the daily min/max aggregates for each station file, building the
+    missing ones in parallel (one process per station).
+
+    Returns
+    -------
+    stationdata : dict
+        {station : daily aggregates table}
+
+    '''
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(cached_aggregates, filelist))
+    return {station : pd.read_parquet(agg_files['daily'])
+            for station, agg_files in results}
+
+
 #%%
         
 # MAIN
@@ -105,38 +233,18 @@ if __name__ == '__main__':
 
     # Load in weather data from the stations, saving the station value
     filelist, dirpath = ResearchModules.getFiles(
-        'Select all downloaded Weather Underground weather station files')
+        'Select all downloaded Weather Underground weather station files',
+        file_type = [('CSV', '*.csv'), ('Parquet', '*.parquet')])
     
-    stationdata={}
-    # Load in data for each file
-    for file in filelist:
-        # Load the file
-        station_name=os.path.splitext(file.rsplit('wu_')[1])[0]
-        print('Loading Station ' + station_name + ' data file...')
-        data = pd.read_csv(file, sep = ',', header = 0)
-        # Determine which measurements are present
-        columns = list(data.columns)
-        colmap = {}
-        for meas in measlist:
-            col = [idx for idx, s in enumerate(columns) if meas in s]
-            colmap[columns[col[0]]] = meas
-        data.rename(columns = colmap, inplace=True)
-        # Convert measurement units
-        data_converted=pd.DataFrame()
-        for measurement in measlist:
-            converted = pd.to_numeric(data[measurement], errors='coerce')
-            if measlist[measurement]['convert'] != False:
-                converted = measlist[measurement]['convert'](converted)
-            data_converted[measurement] = converted
-        # Convert time
-        data_converted['Time'] = pd.to_datetime(data['Time'], format='%Y-%m-%d %I:%M %p')
-        # Save data
-        stationdata[station_name] = data_converted    
-        # Update the station html
+    # Load in the daily aggregates for each station
+    filelist = [WUNDERScrape.station_file(file) for file in filelist]
+    stationdata = load_daily_aggregates(filelist)
+    # Update the station html
+    for station in stationdata:
         station_html = (
             station_html + ' | '
             + '<a href="https://www.wunderground.com/dashboard/pws/'
-            + station_name + '">' + station_name + '</a>')
+            + station + '">' + station + '</a>')
     
     
     # Create plots of each parameter
@@ -158,16 +266,10 @@ if __name__ == '__main__':
         
         # Gather and plot the raw data for each series
         for i,station in enumerate(stationdata):
-            # Get the data for the station
-            sdata = stationdata[station][['Time',measurement]].copy()
-            sdata.set_index('Time', inplace=True)
-            sdata = sdata[~sdata.index.duplicated()]
-            # Generate smoothed hourly data
-            sdata = sdata.resample('1T').interpolate(
-                'index', limit = 20, limit_area = 'inside').resample(
-                    'h').asfreq().dropna()
-            # Find daily min/max values
-            daily_mm = sdata.resample('D')[measurement].agg(['min','max'])        
+            # Get the daily min/max values for the station
+            daily_mm = stationdata[station][
+                [measurement + ' min', measurement + ' max']]
+            daily_mm.columns = ['min', 'max']
             
             # Format the data for bokeh glyph render (new)
             groups = ResearchModules.nansplit(daily_mm)
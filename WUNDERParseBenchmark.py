@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+@project: GSLMO
+
+Benchmarks the WUNDERScrape.py page parser backends on a corpus of saved
+Weather Underground daily pages. Only parsing is timed (no network), so the
+results show how much faster each backend is than the original
+BeautifulSoup approach ('bs4'). The script also checks that every backend
+returns the same headers and values.
+
+Saved pages can be plain (.html, .htm) or gzip-compressed (.gz) files.
+Name the files by date (e.g., 2021-06-30.html) so that the time column is
+labeled with the right date.
+
+Arguments:  None
+
+Example in command line:
+    python WUNDERParseBenchmark.py
+
+You will also need to have the following files
+    in the same directory as this script.
+    They contain modules and variables that this script calls.
+    WUNDERScrape.py
+
+"""
+
+####################
+# IMPORTS
+####################
+import WUNDERScrape
+import os
+import re
+import gzip
+import time
+import numpy as np
+import pandas as pd
+import tkinter as tk
+from tkinter import filedialog
+
+
+####################
+# VARIABLES
+####################
+page_extensions = ('.html', '.htm', '.gz')  # Saved page file types
+date_default = '2000-01-01'     # Date used if a file name contains no date
+repeats = 3                     # Number of timed passes per backend
+
+
+####################
+# FUNCTIONS
+####################
+
+def load_corpus(directory):
+    '''
+    Loads the saved pages in a directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing saved pages.
+
+    Returns
+    -------
+    pages : list of tuples
+        (date, html) for each saved page.
+
+    '''
+    pages = []
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith(page_extensions):
+            continue
+        date = re.search(r'\d{4}-\d{2}-\d{2}', file)
+        date = date.group(0) if date else date_default
+        opener = gzip.open if file.endswith('.gz') else open
+        with opener(os.path.join(directory, file), 'rt',
+                    encoding='utf8') as page:
+            pages.append((date, page.read()))
+    return pages
+
+
+def parse_corpus(pages, backend):
+    '''Parses each page with a backend, returns results (None if no data)'''
+    parse = WUNDERScrape.parsers[backend]
+    results = []
+    for date, html in pages:
+        try:
+            results.append(parse(html, date))
+        except (ValueError, IndexError):
+            results.append(None)
+    return results
+
+
+def compare_results(results, reference):
+    '''Counts pages where the parsed headers or values don't match'''
+    mismatches = 0
+    for result, ref in zip(results, reference):
+        if result is None or ref is None:
+            mismatches += (result is None) != (ref is None)
+            continue
+        if result[0] != ref[0]:
+            mismatches += 1
+            continue
+        for column, ref_column in zip(result[1], ref[1]):
+            # Compare by value, with missing values ('--') as NaN
+            numeric = pd.to_numeric(pd.Series(column), errors='coerce')
+            ref_numeric = pd.to_numeric(pd.Series(ref_column), errors='coerce')
+            if numeric.isna().all() and ref_numeric.isna().all():
+                same = list(map(str, column)) == list(map(str, ref_column))
+            else:
+                same = np.allclose(numeric, ref_numeric, equal_nan=True)
+            if not same:
+                mismatches += 1
+                break
+    return mismatches
+
+
+def benchmark_parsers(pages, backends=None, reference='bs4',
+                      repeats=repeats):
+    '''
+    Times each parser backend over the corpus.
+
+    Parameters
+    ----------
+    pages : list of tuples
+        (date, html) for each saved page, from load_corpus.
+    backends : list of str, optional
+        Backends to time. The default is all of WUNDERScrape.parsers.
+    reference : str, optional
+        Backend to compare speed and results against. The default is 'bs4'.
+    repeats : int, optional
+        Number of timed passes; the fastest is kept. The default is repeats.
+
+    Returns
+    -------
+    results : pandas.DataFrame
+        Parse time, pages per second, speedup, and number of mismatched
+        pages for each backend.
+
+    '''
+    backends = backends or list(WUNDERScrape.parsers)
+    if reference not in backends:
+        backends = [reference] + backends
+    results = pd.DataFrame(
+        index=backends,
+        columns=['seconds', 'pages_per_s', 'speedup', 'mismatches'])
+    parsed = {}
+    for backend in backends:
+        print('Timing the ' + backend + ' parser...')
+        times = []
+        for n in range(repeats):
+            t0 = time.perf_counter()
+            parsed[backend] = parse_corpus(pages, backend)
+            times.append(time.perf_counter() - t0)
+        results.loc[backend, 'seconds'] = min(times)
+        results.loc[backend, 'pages_per_s'] = len(pages) / min(times)
+    results['speedup'] = (results.loc[reference, 'seconds']
+                          / results['seconds'])
+    for backend in backends:
+        results.loc[backend, 'mismatches'] = compare_results(
+            parsed[backend], parsed[reference])
+    return results
+
+
+#%%
+####################
+# MAIN FUNCTION
+####################
+if __name__ == '__main__':
+
+    # Get the directory of saved pages from the user
+    root = tk.Tk()
+    directory = filedialog.askdirectory(
+        initialdir=os.getcwd(), title='Select directory of saved pages')
+    root.destroy()
+
+    pages = load_corpus(directory)
+    print('Loaded ' + str(len(pages)) + ' saved pages.')
+    results = benchmark_parsers(pages)
+    print(results.to_string())
+    results.to_csv(directory + '/parser_benchmark.csv')
@@ -11,8 +11,18 @@ This script does NOT require an API key, enabling the downloading of data
 for any PWS of interest.
 
 This script loads the daily data table for a site for each date in a user-
-selected range, scrapes the data, and adds it to a csv file.
-It saves a csv file containing all of the scrape-able data for the date range.
+selected range, scrapes the data, and adds it to a station file.
+It saves a csv (or parquet) file containing all of the scrape-able data for
+the date range, with a fixed set of typed columns (see station_schema) so
+the file can be loaded without converting values; use load_station_file.
+Several dates are fetched at once over a shared connection pool, with a rate
+limiter (see the rate_limit and rate_burst variables) keeping the load on
+the website polite. Set url_base to test against a local server that serves
+saved pages.
+
+Each fetched page is also saved (gzipped) in a raw page cache in the save
+directory. If the page layout changes, fix the parser and choose the reparse
+mode to rebuild the station file from the cache instead of fetching again.
 
 In order to ensure that data is available in the future (and limit your
 carbon footprint) please use this script with care:
@@ -27,8 +37,14 @@ Great Salt Lake Microbialite Observatory project
 It was modified from a script by jumanbar posted at
 https://stackoverflow.com/questions/55306320/
 
+Several stations can be scraped over the same dates in one run; their pages
+share the connection pool and rate limiter.
+Station files are kept in time order, so a run that adds earlier dates
+(e.g., extending the date range backward) rewrites the file in order.
+
 Arguments:
-    station     (unique station identifier, e.g., KUTSYRAC22)
+    station     (unique station identifier, e.g., KUTSYRAC22, or several
+                 separated by commas)
     date_start  (beginning date to find data for in format %Y-%m-%d,
                  e.g., 2019-01-30)
     date_end    (end date to find data for in format %Y-%m-%d,
@@ -41,9 +57,9 @@ Dependencies Install:
     sudo apt-get install python3-pip python3-dev
     pip install requests
     pip install beautifulsoup4
-    pip install datetime
-    pip install time
-    pip install tkinter
+    pip install pandas
+    pip install numpy
+    pip install pyarrow     (only needed for parquet station files)
 
 
 """
@@ -53,8 +69,20 @@ Dependencies Install:
 #######################
 
 import os
+import re
+import gzip
+import random
+import shutil
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+import pandas as pd
+from html import unescape as html_unescape
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
 import time
 import tkinter as tk
@@ -66,109 +94,744 @@ from tkinter import filedialog
 #######################
 
 # Change these if the page HTML changes
+url_base = 'https://www.wunderground.com/dashboard/pws/' # Point this at a
+                        # local server to test against saved pages
 date_fmt = '%Y-%m-%d' # Date format for the URL
 table_no = 3 # Table number on the website
 time_col = 0 # Column in the website table that contains the time
+missing_values = ['--', ''] # Cell values that mean no data
+
+# Page parser backend (key in the parsers dict defined after the functions)
+#   'regex' reads only the observation table (fast)
+#   'bs4'   parses the whole page with BeautifulSoup
+parser = 'regex'
+
+# Patterns used by the regex parser
+table_pattern = re.compile(r'<table\b', re.I)
+row_pattern = re.compile(r'<tr\b[^>]*>(.*?)</tr>', re.I | re.S)
+th_pattern = re.compile(r'<th\b[^>]*>(.*?)</th>', re.I | re.S)
+td_pattern = re.compile(r'<td\b[^>]*>', re.I)
+tag_pattern = re.compile(r'<[^>]*>')
 
-# Change this as desired
+# Station file schema: column name and type. Names match the page headers
+# with units appended. Times are read from the page in wu_time_fmt.
+station_schema = {
+    'Time'                  : 'datetime64[ns]',
+    'Temperature (F)'       : 'float64',
+    'Dew Point (F)'         : 'float64',
+    'Humidity (%)'          : 'float64',
+    'Wind'                  : 'string',
+    'Speed (mph)'           : 'float64',
+    'Gust (mph)'            : 'float64',
+    'Pressure (in)'         : 'float64',
+    'Precip. Rate. (in)'    : 'float64',
+    'Precip. Accum. (in)'   : 'float64',
+    'UV'                    : 'float64',
+    'Solar'                 : 'float64'
+    }
+wu_time_fmt = '%Y-%m-%d %I:%M %p'
+
+# Change these as desired
+file_format = 'csv' # Station file format: 'csv' or 'parquet'
+flush_days = 30 # Number of scraped days to buffer before writing to file
 max_tries = 5 # Number of times to try to load a date before moving on
+max_workers = 4 # Number of day pages to fetch at once
+rate_limit = 1 # Sustained number of page requests allowed per second
+rate_burst = 4 # Number of page requests allowed in a burst
+backoff_base = 5 # Base wait (s) before retrying a date; doubles each try
+request_timeout = 30 # Seconds to wait for a page to load
+progress_every = 100 # Number of pages between progress reports
+cache_pages = True # Save each fetched page in a raw page cache so the
+                   # station file can be rebuilt later with reparse_station
+cache_folder = 'wu_cache' # Cache folder, inside the save directory
+
+# Lock for the cache manifests (pages are cached from several threads)
+cache_lock = threading.Lock()
+
+
+#######################
+# CLASSES
+#######################
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket rate limiter. Each request takes a token; tokens
+    refill at the sustained rate up to the burst size.
+    '''
+    def __init__(self, rate=rate_limit, burst=rate_burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Blocks until a request is allowed'''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class StationWriter:
+    '''
+    Buffers parsed, typed days of data for a station and writes them to the
+    station file in batches, using the fixed station_schema. The station's
+    scrape index is updated after each batch is written, so the index only
+    lists dates that are saved.
+    
+    CSV data is appended to wu_STATION.csv. Parquet data is written as one
+    part file per batch in the directory wu_STATION.parquet, which
+    pandas.read_parquet reads as a single table.
+    '''
+    def __init__(self, filename, index_file, fmt=file_format,
+                 batch_days=flush_days):
+        self.filename = filename
+        self.index_file = index_file
+        self.fmt = fmt
+        self.batch_days = batch_days
+        self.buffer = []
+        self.dates = {'scraped' : [], 'empty' : []}
+
+    def add(self, date, headers, columns):
+        '''Adds a day of parsed data'''
+        self.add_table(date, to_schema(headers, columns))
+
+    def add_table(self, date, data):
+        '''Adds a day of data already converted with to_schema'''
+        self.buffer.append(data)
+        self.dates['scraped'].append(date)
+        if len(self.buffer) >= self.batch_days:
+            self.flush()
+
+    def add_empty(self, date):
+        '''Records a date confirmed to have no data'''
+        self.dates['empty'].append(date)
+
+    def flush(self):
+        '''Writes buffered data to the station file and updates the index'''
+        if self.buffer:
+            data = pd.concat(self.buffer, ignore_index=True)
+            if self.fmt == 'parquet':
+                os.makedirs(self.filename, exist_ok=True)
+                data.to_parquet(
+                    self.filename + '/part-' + self.dates['scraped'][0]
+                    + '_' + self.dates['scraped'][-1] + '.parquet',
+                    index=False)
+            else:
+                header = not (os.path.isfile(self.filename)
+                              and os.path.getsize(self.filename))
+                data.to_csv(self.filename, mode='a', header=header,
+                            index=False, encoding='utf8')
+        for status in self.dates:
+            update_scrape_index(self.index_file, self.dates[status], status)
+        self.buffer = []
+        self.dates = {'scraped' : [], 'empty' : []}
 
 
 #######################
 # FUNCTIONS
 #######################
 
-def scrape_page(file, station, date, header=True):
+def new_session(pool_size=max_workers):
     '''
-    Function scrapes the page for the input date and saves the data to the
-    data file.
+    Creates a requests session with a connection pool large enough for the
+    number of concurrent page fetches, so connections are reused.
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def scrape_page(session, limiter, station, date, cache_dir=None):
+    '''
+    Function fetches and scrapes the page for the input date, retrying with
+    jittered exponential backoff if the page fails to load. If a cache
+    directory is given, each fetched page is saved there before parsing.
 
     Parameters
     ----------
-    file : str
-        The file path containing the csv to create or append.
+    session : requests.Session
+        Shared session used to fetch the page.
+    limiter : TokenBucket
+        Shared rate limiter.
+    station : str
+        Weather Underground station code, e.g., KUTSYRAC22
     date : str
         The date, formatted as defined by the date_fmt variable.
-    header : bool
-        Whether or not to include the header row. The default is True.
-        Setting header = False omits the header row.
+    cache_dir : str, optional
+        Raw page cache directory. The default (None) does not cache pages.
 
     Raises
     ------
     ValueError
         If no data is found for the date (but the website otherwise loads),
         a ValueError is raised.
+    IOError
+        If the page still fails to load after max_tries attempts.
 
     Returns
     -------
-    None.
+    headers : list of str
+        Column headers, with units appended.
+    columns : list of lists or numpy.ndarray
+        Data values for each column, with the date added to the time value.
 
     '''
-    
     # Generate the URL string
-    url = ('https://www.wunderground.com/dashboard/pws/'
-           + station + '/table/' + date + '/' + date + '/daily')
-           
-    # Scrape the URL
-    content = requests.get(url)
-    soup = BeautifulSoup(content.text, 'html.parser')
+    url = (url_base + station + '/table/' + date + '/' + date + '/daily')
+
+    for attempt in range(max_tries):
+        # Wait for the rate limiter, then scrape the URL
+        limiter.acquire()
+        try:
+            content = session.get(url, timeout=request_timeout)
+            content.raise_for_status()
+            if cache_dir:
+                cache_page(cache_dir, station, date, content.text)
+            return parsers[parser](content.text, date)
+        # A request error or IndexError indicates a problem with website
+        # loading: wait and try again
+        except (requests.RequestException, IndexError):
+            time.sleep(random.uniform(0.5, 1.5) * backoff_base * 2**attempt)
+
+    raise IOError('Could not load the page for ' + date + '.')
+
+
+def parse_page_bs4(html, date):
+    '''
+    Parses the data table from a page with BeautifulSoup, reading the
+    whole page and stripping units from each cell.
+
+    Parameters
+    ----------
+    html : str
+        Page HTML text.
+    date : str
+        The date, formatted as defined by the date_fmt variable.
+
+    Raises
+    ------
+    ValueError
+        If there is no data for the date.
+    IndexError
+        If the data table is not on the page.
+
+    Returns
+    -------
+    headers : list of str
+        Column headers, with units appended.
+    columns : list of lists
+        Data values for each column, with the date added to the time value.
+
+    '''
+    soup = BeautifulSoup(html, 'html.parser')
     
     # Find the data table on the page
     tables = soup.find_all('table')
-    data_table = tables[3]
+    data_table = tables[table_no]
     rows = data_table.findAll('tr')
      
     # Raise an error if there is no data for the date
     if len(rows)<3:
         raise ValueError('There is no data for ' + date + '.')
     
-    # Save scraped data as csv-formatted text
-    print('Saving data for ' + date + '...')
-    out_file = open(file,'a',encoding='utf8')
-
-    if header:
-        # Get the header values (row 1)
-        table_head = data_table.findAll('th')
-        headers = []
-        for head in table_head:
-            headers.append(head.text.strip())
-            
-        # Append units to the header values
-        firstrow = rows[2].findAll('td')
-        for i,column in enumerate(firstrow):
+    # Get the header values (row 1)
+    table_head = data_table.findAll('th')
+    headers = []
+    for head in table_head:
+        headers.append(head.text.strip())
+        
+    # Append units to the header values
+    firstrow = rows[2].findAll('td')
+    for i,column in enumerate(firstrow):
+        text = column.text.strip()
+        text = text.rsplit('\xa0°')
+        if len(text)>1:
+            headers[i] = headers[i] + ' (' + text[1] + ')'
+    
+    # Get each row of data
+    output_rows = []
+    for row in range(2, len(rows)):
+        columns = rows[row].findAll('td')
+        output_row = []
+        for column in columns:
             text = column.text.strip()
-            text = text.rsplit('\xa0°')
-            if len(text)>1:
-                headers[i] = headers[i] + ' (' + text[1] + ')'
-                
-        # Write the header values
-        out_file.write(','.join(headers) + '\n')
+            outtext = text.rsplit('\xa0°')[0]
+            outtext = outtext.rsplit(' w/m²')[0]
+            output_row.append(outtext)
+        
+        # Add the date to the time value
+        output_row[time_col] = date + ' ' + output_row[time_col]
+        output_rows.append(output_row)
+        
+    return headers, [list(column) for column in zip(*output_rows)]
+
+
+def parse_page_regex(html, date):
+    '''
+    Parses the data table from a page with regular expressions. Only the
+    observation table is read; units are found once per column and stripped
+    from the whole column, and numeric columns are converted to numbers.
+
+    Parameters
+    ----------
+    html : str
+        Page HTML text.
+    date : str
+        The date, formatted as defined by the date_fmt variable.
+
+    Raises
+    ------
+    ValueError
+        If there is no data for the date.
+    IndexError
+        If the data table is not on the page.
+
+    Returns
+    -------
+    headers : list of str
+        Column headers, with units appended.
+    columns : list of lists or numpy.ndarray
+        Data values for each column, with the date added to the time value.
+        Numeric columns are float arrays, with missing values ('--') as NaN.
+
+    '''
+    # Jump straight to the observation table
+    starts = [match.start() for match in islice(
+        table_pattern.finditer(html), table_no + 1)]
+    start = starts[table_no]
+    table = html[start:html.find('</table>', start)]
+    rows = row_pattern.findall(table)
+    
+    # Raise an error if there is no data for the date
+    if len(rows)<3:
+        raise ValueError('There is no data for ' + date + '.')
+    
+    # Get the header values
+    headers = [cell_text(head) for head in th_pattern.findall(table)]
     
-    # Write each row of data
-    if len(rows)>2:
-        for row in range(2, len(rows)):
-            columns = rows[row].findAll('td')
-            output_row = []
-            for column in columns:
-                text = column.text.strip()
-                outtext = text.rsplit('\xa0°')[0]
-                outtext = outtext.rsplit(' w/m²')[0]
-                output_row.append(outtext)
-            
-            # Add the date to the time value
-            output_row[time_col] = date + ' ' + output_row[time_col]
-            
-            # Add the row to the csv text
-            out_file.write(','.join(output_row) + '\n')
+    # Mark cell & row boundaries, then strip the tags from all rows at once
+    body = td_pattern.sub('\x1f', '\x1e'.join(rows[2:]))
+    body = html_unescape(tag_pattern.sub('', body))
+    rows = [row.split('\x1f')[1:] for row in body.split('\x1e')]
     
-    # Save the file
-    out_file.close()
+    # Pad any short rows so each column has a value for each row
+    ncols = len(headers)
+    rows = [row + ['']*(ncols - len(row)) if len(row) < ncols else row[:ncols]
+            for row in rows]
+    
+    # Strip units & convert each column
+    columns = []
+    for i, values in enumerate(zip(*rows)):
+        values = pd.Series(values).str.strip()
+        if i == time_col:
+            columns.append(list(date + ' ' + values))
+            continue
+        # Find the unit once from the first value that has one
+        suffix = ''
+        for value in values:
+            if '\xa0°' in value:
+                suffix = value[value.index('\xa0°'):]
+                headers[i] = headers[i] + ' (' + suffix[2:] + ')'
+                break
+            if value.endswith(' w/m²'):
+                suffix = ' w/m²'
+                break
+        if suffix:
+            values = values.str.replace(suffix, '', regex = False)
+        # Convert to numbers if all of the non-missing values are numeric
+        numeric = pd.to_numeric(values, errors = 'coerce')
+        if numeric.notna().sum() == (~values.isin(missing_values)).sum():
+            columns.append(numeric.to_numpy(dtype = float))
+        else:
+            columns.append(list(values))
+        
+    return headers, columns
+
+
+def cell_text(cell):
+    '''Returns the text of an HTML table cell without tags'''
+    return html_unescape(tag_pattern.sub('', cell)).strip()
+
+
+def to_schema(headers, columns):
+    '''
+    Converts a day of parsed data to a table with the station_schema columns
+    and types. Columns missing from the page are left empty, missing_values
+    placeholders (e.g., '--') become missing values, and columns not in the
+    schema are dropped.
+
+    Parameters
+    ----------
+    headers : list of str
+        Column headers.
+    columns : list of lists or numpy.ndarray
+        Data values for each column.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        Typed table of the day's data.
+
+    '''
+    data = pd.DataFrame(dict(zip(range(len(headers)), columns)))
+    data.columns = headers
+    data = data.reindex(columns=list(station_schema))
+    for col, dtype in station_schema.items():
+        if dtype.startswith('datetime'):
+            data[col] = pd.to_datetime(
+                data[col], format=wu_time_fmt, errors='coerce')
+        elif dtype.startswith('float'):
+            data[col] = pd.to_numeric(data[col], errors='coerce')
+        else:
+            data[col] = data[col].replace(missing_values, pd.NA)
+    return data.astype(station_schema)
+
+
+def load_station_file(filename):
+    '''
+    Loads a station file saved by this script (CSV or Parquet) with the
+    station_schema types. Files saved as text by older versions of this
+    script (with '--' for missing values) are converted on load.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the station file (wu_STATION.csv or wu_STATION.parquet), or
+        of a part file in a wu_STATION.parquet directory.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        Table of station data, with the Time column as timestamps.
+
+    '''
+    filename = station_file(filename)
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
     
-def get_weather_for_range(station, date_start, date_end, directory):
+    dtypes = {col : dtype for col, dtype in station_schema.items()
+              if not dtype.startswith('datetime')}
+    try:
+        data = pd.read_csv(filename, dtype=dtypes)
+        data['Time'] = pd.to_datetime(data['Time'], format='%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        text = pd.read_csv(filename, dtype=str)
+        data = to_schema(list(text.columns),
+                         [text[col] for col in text.columns])
+        # Rows appended by this version of the script to an older file
+        data['Time'] = data['Time'].fillna(pd.to_datetime(
+            text['Time'], format='%Y-%m-%d %H:%M:%S', errors='coerce'))
+    return data
+
+
+def iter_station_file(filename, columns=None, chunk_rows=100000):
+    '''
+    Reads a station file in chunks of rows, in file order, with the
+    station_schema types, so that long records can be processed without
+    loading the whole file.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the station file (wu_STATION.csv or wu_STATION.parquet), or
+        of a part file in a wu_STATION.parquet directory.
+    columns : list of str, optional
+        Columns to read in addition to Time. The default reads all columns.
+    chunk_rows : int, optional
+        Max number of rows in each chunk. The default is 100000.
+
+    Yields
+    ------
+    data : pandas.DataFrame
+        Chunk of station data, with the Time column as timestamps.
+
+    '''
+    filename = station_file(filename)
+    columns = ['Time'] + [col for col in (columns or list(station_schema))
+                          if col != 'Time']
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for part in sorted(os.listdir(filename)):
+            part = pq.ParquetFile(os.path.join(filename, part))
+            for batch in part.iter_batches(chunk_rows, columns=columns):
+                yield batch.to_pandas()
+        return
+    
+    # Check whether the file was saved as text by an older version of the
+    # script; if so, convert each chunk on load
+    first = pd.read_csv(filename, usecols=['Time'], nrows=1, dtype=str)
+    legacy = (len(first) and pd.isna(pd.to_datetime(
+        first['Time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')[0]))
+    dtypes = {col : 'str' if legacy else station_schema[col]
+              for col in columns if col != 'Time'}
+    for data in pd.read_csv(filename, usecols=columns, dtype=dtypes,
+                            chunksize=chunk_rows):
+        if legacy:
+            text = data
+            data = to_schema(list(text.columns),
+                             [text[col] for col in text.columns])[columns]
+            data['Time'] = data['Time'].fillna(pd.to_datetime(
+                text['Time'], format='%Y-%m-%d %H:%M:%S', errors='coerce'))
+        else:
+            data['Time'] = pd.to_datetime(
+                data['Time'], format='%Y-%m-%d %H:%M:%S')
+        yield data
+
+
+def sort_station_file(filename):
+    '''
+    Rewrites a station file (CSV or Parquet) with its rows in time order,
+    e.g., after earlier dates were appended to it. Rows without a valid time
+    are kept at the end. The new file replaces the old one only once it is
+    completely written.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the station file (wu_STATION.csv or wu_STATION.parquet).
+
+    Returns
+    -------
+    None.
+
+    '''
+    print('Sorting ' + filename + ' by time...')
+    data = load_station_file(filename).sort_values('Time', kind='stable')
+    tmp_file = filename + '.tmp'
+    if filename.endswith('.parquet'):
+        if os.path.isdir(tmp_file):
+            shutil.rmtree(tmp_file)
+        os.makedirs(tmp_file)
+        times = data['Time'].dropna()
+        part = (times.iloc[0].strftime(date_fmt) + '_'
+                + times.iloc[-1].strftime(date_fmt)) if len(times) else 'all'
+        data.to_parquet(tmp_file + '/part-' + part + '.parquet', index=False)
+        shutil.rmtree(filename)
+    else:
+        data.to_csv(tmp_file, index=False, encoding='utf8',
+                    date_format='%Y-%m-%d %H:%M:%S')
+    os.replace(tmp_file, filename)
+
+
+def station_file(filename):
+    '''
+    Returns the station file for a selected file: the parquet directory if a
+    part file inside it was selected, otherwise the file itself.
+    '''
+    directory = os.path.dirname(filename)
+    if directory.endswith('.parquet'):
+        return directory
+    return filename
+
+
+def cache_page(cache_dir, station, date, html):
+    '''
+    Saves a fetched page in the raw page cache. Pages are stored gzipped
+    under the SHA-1 hash of their contents (so identical pages, such as
+    empty days, are stored once), and each station's manifest maps dates
+    to page hashes. A later entry for a date replaces an earlier one.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Raw page cache directory.
+    station : str
+        Weather Underground station code, e.g., KUTSYRAC22
+    date : str
+        The date, formatted as defined by the date_fmt variable.
+    html : str
+        Page HTML text.
+
+    Returns
+    -------
+    digest : str
+        Hash of the page contents.
+
+    '''
+    page = html.encode('utf8')
+    digest = hashlib.sha1(page).hexdigest()
+    page_file = cached_page_file(cache_dir, digest)
+    if not os.path.isfile(page_file):
+        os.makedirs(os.path.dirname(page_file), exist_ok=True)
+        # Write to a temporary file first so a partly written page is never
+        # read from the cache
+        tmp_file = page_file + '.' + str(threading.get_ident()) + '.tmp'
+        with gzip.open(tmp_file, 'wb') as file:
+            file.write(page)
+        os.replace(tmp_file, page_file)
+    with cache_lock:
+        manifest = cache_dir + '/' + station + '.csv'
+        new_file = not os.path.isfile(manifest)
+        with open(manifest, 'a', encoding='utf8') as file:
+            if new_file:
+                file.write('date,page\n')
+            file.write(date + ',' + digest + '\n')
+    return digest
+
+
+def cached_page_file(cache_dir, digest):
+    '''Returns the path of a cached page from its hash'''
+    return cache_dir + '/pages/' + digest[:2] + '/' + digest + '.html.gz'
+
+
+def load_cache_manifest(cache_dir, station):
+    '''Returns {date : page hash} for a station's cached pages'''
+    manifest = cache_dir + '/' + station + '.csv'
+    if not os.path.isfile(manifest):
+        return {}
+    manifest = pd.read_csv(manifest, dtype=str)
+    return dict(zip(manifest['date'], manifest['page']))
+
+
+def parse_cached_page(cache_dir, digest, date, parser_name):
+    '''
+    Parses a cached page (run in a worker process by reparse_station).
+
+    Returns
+    -------
+    status : str
+        'scraped', 'empty' (no data for the date), or 'failed' (the data
+        table could not be found).
+    data : pandas.DataFrame or None
+        Typed table of the day's data if status is 'scraped'.
+
+    '''
+    with gzip.open(cached_page_file(cache_dir, digest), 'rt',
+                   encoding='utf8') as file:
+        html = file.read()
+    try:
+        headers, columns = parsers[parser_name](html, date)
+    except ValueError:
+        return 'empty', None
+    except IndexError:
+        return 'failed', None
+    return 'scraped', to_schema(headers, columns)
+
+
+def reparse_station(station, directory, cache_dir=None, workers=None,
+                    parser_name=parser, fmt=file_format):
+    '''
+    Rebuilds a station file and its scrape index from the raw page cache,
+    without fetching anything. Use this after fixing a parser (e.g., when
+    the page layout changes). Pages are parsed in a pool of processes.
+    Dates without a cached page keep their rows and index entries from the
+    old files, and nothing is changed if the station has no cached pages.
+    The new files replace the old ones only once every page is parsed.
+
+    Parameters
+    ----------
+    station : str
+        Weather Underground station code, e.g., KUTSYRAC22
+    directory : str
+        directory where the station file is saved
+    cache_dir : str, optional
+        Raw page cache directory. The default is cache_folder in directory.
+    workers : int, optional
+        Number of processes. The default is the number of CPUs.
+    parser_name : str, optional
+        Key of the parser in the parsers dict. The default is parser.
+    fmt : str, optional
+        Station file format, 'csv' or 'parquet'. The default is file_format.
+
+    Returns
+    -------
+    filename : str
+        name of the rebuilt data file
+
+    '''
+    cache_dir = cache_dir or directory + '/' + cache_folder
+    filename = directory + '/wu_' + station + '.' + fmt
+    index_file = directory + '/wu_' + station + '_index.csv'
+    pages = dict(load_cache_manifest(cache_dir, station))
+    if not pages:
+        print('\nNo cached pages for Station ' + station + ' in ' + cache_dir
+              + '; ' + filename + ' was left as it is.')
+        return filename
+    print('\n*** Reparsing ' + str(len(pages)) + ' cached pages for Station '
+          + station + '. ***\n')
+    
+    # Dates that were not cached (e.g., scraped before page caching or with
+    # cache_pages False) keep their saved rows and index entries
+    kept = {date : status for date, status
+            in load_scrape_index(index_file, filename).items()
+            if date not in pages}
+    kept_rows = {}
+    if os.path.exists(filename):
+        for data in iter_station_file(filename):
+            dates = data['Time'].dt.strftime(date_fmt)
+            data = data[dates.notna() & ~dates.isin(pages)]
+            for date, rows in data.groupby(dates[data.index]):
+                kept_rows.setdefault(date, []).append(rows)
+    for date in kept_rows:
+        kept[date] = 'scraped'
+    
+    # Remove temporary files left by an interrupted reparse
+    for file in [filename + '.tmp', index_file + '.tmp']:
+        if os.path.isdir(file):
+            shutil.rmtree(file)
+        elif os.path.isfile(file):
+            os.remove(file)
+    
+    writer = StationWriter(filename + '.tmp', index_file + '.tmp', fmt = fmt)
+    failed = []
+    cached = sorted(pages.items())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            parse_cached_page, *zip(*[
+                (cache_dir, digest, date, parser_name)
+                for date, digest in cached]),
+            chunksize = 16)
+        # Write the cached and kept dates in date order
+        for date in sorted(set(pages) | set(kept)):
+            if date in kept:
+                if kept[date] == 'scraped':
+                    writer.add_table(date, pd.concat(
+                        kept_rows.get(date, []) or [to_schema([], [])],
+                        ignore_index=True))
+                else:
+                    writer.add_empty(date)
+                continue
+            status, data = next(results)
+            if status == 'scraped':
+                writer.add_table(date, data)
+            elif status == 'empty':
+                writer.add_empty(date)
+            else:
+                failed.append(date)
+    writer.flush()
+    
+    # Replace the old station file & index with the files that were written
+    for file in [filename, index_file]:
+        if not os.path.exists(file + '.tmp'):
+            continue
+        if os.path.isdir(file):
+            shutil.rmtree(file)
+        os.replace(file + '.tmp', file)
+    if failed:
+        print('The data table was not found for ' + str(len(failed))
+              + ' dates (e.g., ' + failed[0] + '); check the parser.')
+    return filename
+
+
+def get_weather_for_range(station, date_start, date_end, directory,
+                          workers=max_workers, session=None, limiter=None,
+                          fmt=file_format, cache_dir=None):
     '''
     This script scrapes weather data for each date within a date range
     from the Weather Underground station indicated and saves the combined file
-    in the selected directory.
+    in the selected directory. Several dates are fetched at once through a
+    shared session and rate limiter, but rows are written in date order.
 
     Parameters
     ----------
@@ -180,6 +843,17 @@ def get_weather_for_range(station, date_start, date_end, directory):
         end date in the format 'yyyy-mm-dd'
     directory : str
         directory where data should be saved
+    workers : int, optional
+        Number of pages to fetch at once. The default is max_workers.
+    session : requests.Session, optional
+        Session to fetch pages with. The default creates a new session.
+    limiter : TokenBucket, optional
+        Rate limiter to share. The default creates a new limiter.
+    fmt : str, optional
+        Station file format, 'csv' or 'parquet'. The default is file_format.
+    cache_dir : str, optional
+        Raw page cache directory. The default is cache_folder in directory
+        if cache_pages is True; otherwise pages are not cached.
 
     Returns
     -------
@@ -187,49 +861,232 @@ def get_weather_for_range(station, date_start, date_end, directory):
         name of the combined data file
 
     '''
-    print('\n*** Scraping Weather Underground for data from Station '
-          + station + ' between ' + date_start
-          + ' and ' + date_end + '. ***\n')
+    filenames, summary = get_weather_for_stations(
+        [station], date_start, date_end, directory, workers = workers,
+        session = session, limiter = limiter, fmt = fmt,
+        cache_dir = cache_dir)
+    return filenames[station]
+
+
+def get_weather_for_stations(stations, date_start, date_end, directory,
+                             workers=max_workers, session=None, limiter=None,
+                             fmt=file_format, cache_dir=None):
+    '''
+    Scrapes weather data for several stations over the same date range.
+    All station/date pages are fetched through one shared session and rate
+    limiter, taking each date for every station in turn so that all of the
+    stations progress together. One file is saved per station, with rows in
+    date order. Station files are kept in time order: if a run adds dates
+    earlier than the last date already saved (e.g., the range is extended
+    backward, or failed dates are retried), the file is rewritten in time
+    order at the end of the run (see sort_station_file). Progress is
+    reported every progress_every pages.
+
+    Parameters
+    ----------
+    stations : list of str
+        Weather Underground station codes, e.g., ['KUTSYRAC22','KUTSYRAC27']
+    date_start : str
+       start date in the format 'yyyy-mm-dd'
+    date_end : str
+        end date in the format 'yyyy-mm-dd'
+    directory : str
+        directory where data should be saved
+    workers : int, optional
+        Number of pages to fetch at once. The default is max_workers.
+    session : requests.Session, optional
+        Session to fetch pages with. The default creates a new session.
+    limiter : TokenBucket, optional
+        Rate limiter to share. The default creates a new limiter.
+    fmt : str, optional
+        Station file format, 'csv' or 'parquet'. The default is file_format.
+    cache_dir : str, optional
+        Raw page cache directory. The default is cache_folder in directory
+        if cache_pages is True; otherwise pages are not cached.
+
+    Returns
+    -------
+    filenames : dict
+        {station : name of the station's data file}
+    summary : pandas.DataFrame
+        Number of dates to scrape, scraped, empty, and failed, and pages
+        per second, for each station.
+
+    '''
+    print('\n*** Scraping Weather Underground for data from Station'
+          + ('s ' if len(stations) > 1 else ' ') + ', '.join(stations)
+          + ' between ' + date_start + ' and ' + date_end + '. ***\n')
+    
+    session = session or new_session(workers)
+    limiter = limiter or TokenBucket()
+    if cache_pages and not cache_dir:
+        cache_dir = directory + '/' + cache_folder
     
-    filename = directory + '/wu_' + station + '.csv'
+    # Set up each station: find the dates in the range that still need to
+    # be scraped, and a writer for its file
+    filenames = {}
+    writers = {}
+    dates = {}
+    resort = {}
+    for station in stations:
+        filenames[station] = directory + '/wu_' + station + '.' + fmt
+        index_file = directory + '/wu_' + station + '_index.csv'
+        scraped = load_scrape_index(index_file, filenames[station])
+        dates[station] = [date for date in date_range(date_start, date_end)
+                          if date not in scraped]
+        # New dates before the last saved date put the file out of order
+        saved = [date for date in scraped if scraped[date] == 'scraped']
+        resort[station] = bool(saved and dates[station]
+                               and dates[station][0] < max(saved))
+        writers[station] = StationWriter(
+            filenames[station], index_file, fmt = fmt)
+        print(station + ': ' + str(len(dates[station]))
+              + ' dates left to scrape.')
+    summary = pd.DataFrame(
+        0, index = list(stations),
+        columns = ['to_scrape', 'scraped', 'empty', 'failed'])
+    summary['to_scrape'] = [len(dates[station]) for station in stations]
+    
+    # Interleave the stations' dates
+    remaining = {station : set(dates[station]) for station in stations}
+    jobs = [(session, limiter, station, date, cache_dir)
+            for date in date_range(date_start, date_end)
+            for station in stations
+            if date in remaining[station]]
         
-    # Loop through each date in the range and scrape the station's data
-    dt_start = datetime.strptime(date_start, date_fmt)
-    dt_end = datetime.strptime(date_end, date_fmt)
-    dt_curr = dt_start
-    header = True
-    try_count = 0
-    while dt_curr<=dt_end:
-        # Scrape the Weather Underground data table page
+    # Scrape the Weather Underground data table pages concurrently, saving
+    # the results in date order for each station
+    t_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
         try:
-            scrape_page(filename, station, dt_curr.strftime(date_fmt),
-                        header = header)
-        # If a ValueError is returned, skip to the next date
-        except ValueError as e:
-            print(e)
-            dt_curr = next_day(dt_curr)
-        # An IndexError indicates a problem with website loading
-        except IndexError:
-            if try_count < max_tries:
-                # Wait and try again
-                time.sleep(5)
-                try_count += 1
-            else:
-                # After the max number of tries is reached, skip the date
-                dt_curr = next_day(dt_curr)
-                try_count = 0
-        else:
-            header = False
-            dt_curr = next_day(dt_curr)
-            
-    return filename
+            for n, (job, future) in enumerate(ordered_results(
+                    executor, scrape_page, jobs, window = workers*2)):
+                station, date = job[2:4]
+                try:
+                    headers, columns = future.result()
+                # If a ValueError is returned, the date is confirmed empty
+                except ValueError as e:
+                    print(station + ': ' + str(e))
+                    writers[station].add_empty(date)
+                    summary.loc[station, 'empty'] += 1
+                # If an IOError is returned, skip the date (retry next run)
+                except IOError as e:
+                    print(station + ': ' + str(e))
+                    summary.loc[station, 'failed'] += 1
+                else:
+                    writers[station].add(date, headers, columns)
+                    summary.loc[station, 'scraped'] += 1
+                if (n+1) % progress_every == 0:
+                    report_progress(summary, time.monotonic() - t_start)
+        finally:
+            # Save whatever has been scraped, even if interrupted, and put
+            # the file back in time order if needed
+            for station in stations:
+                writers[station].flush()
+                if resort[station] and summary.loc[station, 'scraped']:
+                    sort_station_file(filenames[station])
+    
+    report_progress(summary, time.monotonic() - t_start)
+    return filenames, summary
+
+
+def report_progress(summary, elapsed):
+    '''
+    Prints the progress and throughput of each station in a batch scrape,
+    adding the pages_per_s column to the summary table.
+    '''
+    done = summary[['scraped', 'empty', 'failed']].sum(axis=1)
+    summary['pages_per_s'] = (done / max(elapsed, 1e-9)).round(2)
+    print('\nProgress after ' + str(round(elapsed)) + ' s:')
+    for station in summary.index:
+        print('  ' + station + ': ' + str(done[station]) + '/'
+              + str(summary.loc[station, 'to_scrape']) + ' dates ('
+              + str(summary.loc[station, 'empty']) + ' empty, '
+              + str(summary.loc[station, 'failed']) + ' failed), '
+              + str(summary.loc[station, 'pages_per_s']) + ' pages/s')
+    
+    
+def load_scrape_index(index_file, data_file):
+    '''
+    Loads the index of dates already scraped for a station. If there is a
+    data file but no index (e.g., a file from an older version of this
+    script), the index is built from the dates in the data file.
+
+    Parameters
+    ----------
+    index_file : str
+        Path of the station's index file.
+    data_file : str
+        Path of the station's data file.
+
+    Returns
+    -------
+    scraped : dict
+        {date : status} for each date in the index, where status is
+        'scraped' (data saved) or 'empty' (page loaded but had no data).
+
+    '''
+    if os.path.isfile(index_file):
+        index = pd.read_csv(index_file, dtype=str)
+        return dict(zip(index['date'], index['status']))
     
+    scraped = {}
+    if os.path.isfile(data_file) and os.path.getsize(data_file):
+        # Parquet station files are always written with an index
+        print('Indexing dates already in ' + data_file + '...')
+        times = pd.read_csv(data_file, usecols=[time_col], dtype=str)
+        dates = sorted(set(times.iloc[:,0].str[:10].dropna()))
+        update_scrape_index(index_file, dates, 'scraped')
+        scraped = dict.fromkeys(dates, 'scraped')
+    return scraped
+
+
+def update_scrape_index(index_file, dates, status):
+    '''Appends dates with their scrape status to the station's index'''
+    new_file = not os.path.isfile(index_file)
+    with open(index_file, 'a', encoding='utf8') as file:
+        if new_file:
+            file.write('date,status\n')
+        for date in dates:
+            file.write(date + ',' + status + '\n')
+
+
+def ordered_results(executor, function, jobs, window):
+    '''
+    Submits function(*job) to the executor for each job, keeping at most
+    window jobs in flight, and yields (job, future) in submission order.
+    '''
+    pending = deque()
+    for job in jobs:
+        pending.append((job, executor.submit(function, *job)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+    
+def date_range(date_start, date_end):
+    '''Returns the list of dates from date_start to date_end (inclusive)'''
+    dt_curr = datetime.strptime(date_start, date_fmt)
+    dt_end = datetime.strptime(date_end, date_fmt)
+    dates = []
+    while dt_curr<=dt_end:
+        dates.append(dt_curr.strftime(date_fmt))
+        dt_curr = next_day(dt_curr)
+    return dates
+
     
 def next_day(dt):
     ''' Advance the datetime value (dt) by one day '''
     nextday = dt + timedelta(days=1)
     return nextday
 
+# Available page parser backends
+parsers = {
+    'bs4'   : parse_page_bs4,
+    'regex' : parse_page_regex
+    }
+
 #%%
         
 # MAIN
@@ -240,17 +1097,29 @@ if __name__ == '__main__':
           ''')
     
     # Get input parameters from the user
-    station = input('Enter the 10-digit station code (e.g., KUTSYRAC22)  > ')
-    date_start = input('Enter the start date (format: 2020-02-28)  > ')
-    date_end = input('Enter the end date (format: 2021-04-19)  > ')
+    mode = input('Enter scrape (fetch pages) or reparse (rebuild station '
+                 'files from cached pages)  > ').strip().lower()
+    stations = input('Enter the 10-digit station code, or several separated '
+                     'by commas (e.g., KUTSYRAC22,KUTSYRAC27)  > ')
+    stations = [station.strip() for station in stations.split(',')
+                if station.strip()]
+    if mode != 'reparse':
+        date_start = input('Enter the start date (format: 2020-02-28)  > ')
+        date_end = input('Enter the end date (format: 2021-04-19)  > ')
         
-    # Save the data table contents to a csv file in a user-selected directory
+    # Save the data table contents to a file for each station in a
+    # user-selected directory
     root = tk.Tk()
     directory = filedialog.askdirectory(initialdir=os.getcwd())
     root.destroy()
     
-    filename = get_weather_for_range(station, date_start, date_end, directory)
+    if mode == 'reparse':
+        filenames = [reparse_station(station, directory)
+                     for station in stations]
+    else:
+        filenames, summary = get_weather_for_stations(
+            stations, date_start, date_end, directory)
+        filenames = list(filenames.values())
 
         
-    print('\n*** All done! Data saved in ' + filename + ' ***')
-
+    print('\n*** All done! Data saved in ' + ', '.join(filenames) + ' ***')
@@ -30,6 +30,9 @@ measurements = [
     'Avg. % DAPI fluorescence', 'Avg. % Chl fluorescence',
     'Avg. % Calcein fluorescence','Conc. Extractable DNA (ng/g)']
 
+# Summary file format: 'csv' or 'parquet' (one tidy table) or 'xlsx'
+summary_format = 'csv'
+
 
 ####################
 # FUNCTIONS
@@ -57,8 +60,9 @@ def Pearson(data, dirpath):
     '''
     # Set up grid
     header = pd.MultiIndex.from_product(
-        [measurements,['c','p']], names=['meas','stat'])
-    statgrid = pd.DataFrame(index = measurements, columns = header)
+        [measurements,['c','p']], names=['measurement_2','stat'])
+    statgrid = pd.DataFrame(index = measurements, columns = header,
+                            dtype = float)
     # Loop through each measurement each way
     for meas1 in measurements:
         for meas2 in measurements:
@@ -70,17 +74,22 @@ def Pearson(data, dirpath):
                 
                 # Calculate pearson correlation
                 c,p = pearsonr(meastable[meas1],meastable[meas2])
-                statgrid.loc[meas1][meas2,'c'] = c
-                statgrid.loc[meas1][meas2,'p'] = p
+                statgrid.loc[meas1, (meas2,'c')] = c
+                statgrid.loc[meas1, (meas2,'p')] = p
                 
-    statgrid.to_excel(dirpath + '/pearson_stats.xlsx')
+    statgrid.index.name = 'measurement'
+    ResearchModules.save_summary(
+        statgrid, dirpath + '/pearson_stats', summary_format)
             
     return statgrid
-            
-            #%%
-            ####################
-            # CODE
-            ####################
-            if __name__ == '__main__': 
-                data, dirpath = importData()
-                
+
+
+#%%
+####################
+# CODE
+####################
+if __name__ == '__main__': 
+    data, dirpath = importData()
+    Pearson(data, dirpath)
+    ResearchModules.wait_for_summaries()
+
@@ -7,61 +7,290 @@ Created on Sun Nov  6 21:37:48 2022
 Combines weather data from multiple stations by averaging where there is
 overlap.
 
+Any number of stations can be combined. Each station's data is averaged onto
+a common 15-minute grid, then the stations are averaged with weights based
+on their distance from the site, elevation difference from the site, and a
+data quality score (see the stations variable). Station files are read and
+merged in time chunks, so long records from several stations can be
+combined without loading them all at once. Station files must be in time
+order (WUNDERScrape.py keeps them in order): rows earlier than the chunk
+being merged are skipped with a warning. To merge a file saved out of
+order by an older version of WUNDERScrape.py, sort it first with
+    WUNDERScrape.sort_station_file(file)
+Rows without a valid time are skipped.
+
+The merged file contains, for each measurement column:
+    STATION_COLUMN      15-minute mean for each station
+    avg_COLUMN          weighted average of the stations with data
+    n_COLUMN            number of stations with data (coverage)
+    mask_COLUMN         coverage mask: bit i is set if station i (in the
+                        order of the stations variable) has data
+
 """
 
 ####################
 # IMPORTS
 ####################
 import ResearchModules
+import WUNDERScrape
 import os
+import numpy as np
 import pandas as pd
 
 
 ####################
 # VARIABLES
 ####################
-stations = ['KUTSYRAC22','KUTSYRAC27']
+# Stations to combine, with their distance (km) and elevation difference (m)
+# from the site and a quality score (0-1, lower for less reliable stations)
+stations = {
+    'KUTSYRAC22'    : {
+        'distance_km'   : 0,
+        'elevation_m'   : 0,
+        'quality'       : 1
+        },
+    'KUTSYRAC27'    : {
+        'distance_km'   : 0,
+        'elevation_m'   : 0,
+        'quality'       : 1
+        }
+    }
 col_P = 'Pressure (in)'
 col_precip = 'Precip. Accum. (in)'
 cols = [col_P, col_precip]
 
+# Weighting: a station's weight is halved at each of these distances
+distance_scale = 10     # km
+elevation_scale = 100   # m
+
+grid_freq = '15min'     # Interval of the common time grid
+chunk_length = '30D'    # Length of time merged at once
+chunk_rows = 100000     # Rows read from each station file at once
+
+
+####################
+# FUNCTIONS
+####################
+
+class StationStream:
+    '''
+    Reads a station file in time order, handing out the rows before a given
+    time and keeping the rest for the next chunk. Rows without a valid time
+    are dropped as they are read.
+    '''
+    def __init__(self, filename, columns):
+        self.chunks = WUNDERScrape.iter_station_file(
+            filename, columns, chunk_rows = chunk_rows)
+        self.buffer = pd.DataFrame(columns = ['Time'] + columns)
+        self.done = False
+        self._read()
+
+    def _read(self):
+        '''Reads the next chunk of the file into the buffer'''
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            return
+        chunk = chunk[chunk['Time'].notna()]
+        if self.buffer.empty:
+            self.buffer = chunk
+        else:
+            self.buffer = pd.concat([self.buffer, chunk], ignore_index=True)
+
+    def exhausted(self):
+        '''Returns True once the whole file is read and handed out'''
+        return self.done and self.buffer.empty
+
+    def first_time(self):
+        '''Returns the earliest remaining timestamp (NaT if none)'''
+        return self.buffer['Time'].min()
+
+    def take(self, time_end):
+        '''Returns the rows before time_end, reading more as needed'''
+        while not self.done and not (self.buffer['Time'] >= time_end).any():
+            self._read()
+        before = (self.buffer['Time'] < time_end).to_numpy()
+        rows = self.buffer[before]
+        self.buffer = self.buffer[~before]
+        return rows
+
+
+def station_weights(station_info):
+    '''
+    Calculates the weight of each station from its distance, elevation
+    difference, and quality score.
+
+    Parameters
+    ----------
+    station_info : dict
+        {station : {'distance_km', 'elevation_m', 'quality'}}
+
+    Returns
+    -------
+    weights : numpy.ndarray
+        Weight of each station, in the order of station_info.
+
+    '''
+    info = pd.DataFrame(station_info).T.astype(float)
+    return (info['quality'].to_numpy()
+            * 0.5**(info['distance_km'].abs().to_numpy() / distance_scale)
+            * 0.5**(info['elevation_m'].abs().to_numpy() / elevation_scale))
+
+
+def bin_means(rows, columns, time_start, nbins):
+    '''
+    Averages a station's rows into grid_freq bins starting at time_start.
+    Rows earlier than time_start (from a file that is not in time order) are
+    skipped with a warning.
+
+    Returns
+    -------
+    means : numpy.ndarray
+        (nbins, len(columns)) array of bin means (NaN for empty bins).
+
+    '''
+    means = np.full((nbins, len(columns)), np.nan)
+    if rows.empty:
+        return means
+    bins = ((rows['Time'] - time_start) // pd.Timedelta(grid_freq)).to_numpy()
+    early = bins < 0
+    if early.any():
+        print('  Skipped ' + str(early.sum()) + ' rows earlier than '
+              + str(time_start) + '; sort the station file by time.')
+    for c, col in enumerate(columns):
+        values = rows[col].to_numpy(dtype=float)
+        valid = ~np.isnan(values) & ~early
+        counts = np.bincount(bins[valid], minlength=nbins)
+        sums = np.bincount(bins[valid], weights=values[valid], minlength=nbins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[:, c] = sums / counts
+    return means
+
+
+def merge_chunk(means, weights, columns, station_names, grid):
+    '''
+    Builds the merged table for one time chunk.
+
+    Parameters
+    ----------
+    means : numpy.ndarray
+        (stations, bins, columns) array of station bin means.
+    weights : numpy.ndarray
+        Weight of each station.
+    columns : list of str
+        Measurement columns.
+    station_names : list of str
+        Station codes.
+    grid : pandas.DatetimeIndex
+        Time of each bin.
+
+    Returns
+    -------
+    merged : pandas.DataFrame
+        Station means, weighted averages, coverage counts, and coverage masks
+        for the bins where at least one station has data.
+
+    '''
+    mask = ~np.isnan(means)
+    w = weights[:, None, None] * mask
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.nansum(means * w, axis=0) / w.sum(axis=0)
+    coverage = mask.sum(axis=0)
+    bits = (mask * (1 << np.arange(len(station_names)))[:, None, None]
+            ).sum(axis=0)
+
+    merged = {}
+    for s, station in enumerate(station_names):
+        for c, col in enumerate(columns):
+            merged[station + '_' + col] = means[s, :, c]
+    for c, col in enumerate(columns):
+        merged['avg_' + col] = avg[:, c]
+        merged['n_' + col] = coverage[:, c]
+        merged['mask_' + col] = bits[:, c]
+    merged = pd.DataFrame(merged, index = grid)
+    merged.index.name = 'Time'
+    return merged[coverage.any(axis=1)]
+
+
+def merge_stations(station_files, outfile, columns=cols,
+                   station_info=stations):
+    '''
+    Merges station files onto a common grid_freq grid, one chunk_length of
+    time at a time, appending each merged chunk to the output file.
+
+    Parameters
+    ----------
+    station_files : dict
+        {station : station file}
+    outfile : str
+        Path of the merged csv file to save.
+    columns : list of str, optional
+        Measurement columns to merge. The default is cols.
+    station_info : dict, optional
+        Station distance, elevation, and quality. The default is stations.
+
+    Returns
+    -------
+    outfile : str
+        Path of the merged csv file.
+
+    '''
+    station_names = list(station_files)
+    weights = station_weights(
+        {station : station_info[station] for station in station_names})
+    streams = [StationStream(station_files[station], columns)
+               for station in station_names]
+
+    starts = [stream.first_time() for stream in streams]
+    starts = [start for start in starts if not pd.isna(start)]
+    if not starts:
+        print('No timestamped data found in the station files.')
+        return outfile
+    time_start = min(starts).floor('D')
+    step = pd.Timedelta(chunk_length)
+    nbins = step // pd.Timedelta(grid_freq)
+
+    header = True
+    while not all(stream.exhausted() for stream in streams):
+        time_end = time_start + step
+        print('Merging ' + time_start.strftime('%Y-%m-%d') + ' to '
+              + time_end.strftime('%Y-%m-%d') + '...')
+        means = np.stack([
+            bin_means(stream.take(time_end), columns, time_start, nbins)
+            for stream in streams])
+        grid = pd.date_range(time_start, periods = nbins, freq = grid_freq)
+        merged = merge_chunk(means, weights, columns, station_names, grid)
+        if not merged.empty:
+            merged.to_csv(outfile, mode = 'w' if header else 'a',
+                          header = header, date_format = '%Y-%m-%d %H:%M:%S')
+            header = False
+        time_start = time_end
+        # Skip ahead over chunks where no station has data
+        starts = [stream.first_time() for stream in streams
+                  if not stream.buffer.empty]
+        if starts:
+            time_start += step * max(0, (min(starts) - time_start) // step)
+
+    return outfile
+
+
 #%%
 ####################
 # MAIN FUNCTION
 ####################
 if __name__ == '__main__':
-    
-    # Read in & process files
+
+    # Select the file for each station
     dirpath = os.getcwd()
-    stationdata = {}
-    col_list=[]
+    station_files = {}
     for station in stations:
-        # Read in file
-        filename, dirpath, data = ResearchModules.fileGet(
+        filelist, dirpath = ResearchModules.getFiles(
             'Select file with weather data for station ' + station,
-            directory=dirpath)
-        # Format timestamp
-        data.index = pd.to_datetime(data.index, errors='coerce')
-        # Format the rest
-        for col in cols:
-            data[col] = pd.to_numeric(
-                data[col], errors='coerce')
-        # Resample to 15 minute intervals
-        col_list.extend([station + '_' + col for col in cols])
-        stationdata[station] = data[cols].dropna().resample('15T').mean()
-    
-    # Merge both series on timestamp
-    stationdata_merged = stationdata[list(stationdata)[0]].merge(
-        stationdata[list(stationdata)[1]], on='Time', how='outer')
-    stationdata_merged.rename(
-        columns=dict(zip(list(stationdata_merged.columns),col_list)),
-        inplace=True)
-    
-    # Average values when both are available
-    for n, col in enumerate(cols):
-        stationdata_merged['avg_' + col] = stationdata_merged[[col_list[n], col_list[len(cols)+n]]].mean(axis=1)
-    
-    # Save the dataframe as a new file
-    stationdata_merged.to_csv(
-        dirpath + '/' + '-'.join(stations) + '_P-precip_data_merged.csv')
+            directory=dirpath,
+            file_type = [('CSV', '*.csv'), ('Parquet', '*.parquet')])
+        station_files[station] = filelist[0]
 
+    # Merge the stations and save the merged data as a new file
+    merge_stations(
+        station_files,
+        dirpath + '/' + '-'.join(stations) + '_P-precip_data_merged.csv')
@@ -49,6 +49,9 @@ measurements = [
     'Avg. % Calcein fluorescence','Conc. Extractable DNA (ng/g)']
 timepoints = [0,7,14,21,72,100]
 
+# Summary file format: 'csv' or 'parquet' (one tidy table) or 'xlsx'
+summary_format = 'csv'
+
 
 ####################
 # FUNCTIONS
@@ -117,10 +120,11 @@ def ANOVA(data, dirpath):
 
     # Set up grid for each variable
     header = pd.MultiIndex.from_product(
-        [measurements,['F','p']], names=['meas','stat'])
-    statgrid_horizon = pd.DataFrame(index = list(sections), columns = header)
+        [measurements,['F','p']], names=['measurement','stat'])
+    statgrid_horizon = pd.DataFrame(
+        index = list(sections), columns = header, dtype = float)
     statgrid_time = pd.DataFrame(
-        index = list(map(str, timepoints)), columns = header)
+        index = list(map(str, timepoints)), columns = header, dtype = float)
     
     # Loop through and calculate ANOVA
     for meas in measurements:
@@ -140,8 +144,8 @@ def ANOVA(data, dirpath):
             # ANOVA calculation
             f,p = f_oneway(*dsets)
             # save calculated ANOVA stats in the dataframe
-            statgrid_horizon.loc[section][meas,'F']=f
-            statgrid_horizon.loc[section][meas,'p']=p
+            statgrid_horizon.loc[section, (meas,'F')] = f
+            statgrid_horizon.loc[section, (meas,'p')] = p
             
         # ANOVA by timepoint (comparing sections)
         for tp in timepoints:
@@ -151,8 +155,8 @@ def ANOVA(data, dirpath):
             valtable = valtable[pd.to_numeric(valtable[meas],errors='coerce').notnull()]
             # if no values for the measurement at the timepoint, skip
             if valtable.empty:
-                statgrid_time.loc[str(tp)][meas,'F']=np.nan
-                statgrid_time.loc[str(tp)][meas,'p']=np.nan
+                statgrid_time.loc[str(tp), (meas,'F')] = np.nan
+                statgrid_time.loc[str(tp), (meas,'p')] = np.nan
             # otherwise, calculate ANOVA
             else:
                 # parse dataset into list of measurements for each horizon
@@ -160,12 +164,16 @@ def ANOVA(data, dirpath):
                 # ANOVA calculation
                 f,p = f_oneway(*dsets)
                 # save calculated ANOVA stats in the dataframe
-                statgrid_time.loc[str(tp)][meas,'F']=f
-                statgrid_time.loc[str(tp)][meas,'p']=p
+                statgrid_time.loc[str(tp), (meas,'F')] = f
+                statgrid_time.loc[str(tp), (meas,'p')] = p
                 
     # Save tables
-    statgrid_horizon.to_excel(dirpath+'/core_ANOVA_byHorizon.xlsx')
-    statgrid_time.to_excel(dirpath+'/core_ANOVA_byTimepoint.xlsx')
+    statgrid_horizon.index.name = 'Horizon'
+    statgrid_time.index.name = 'days_exposure'
+    ResearchModules.save_summary(
+        statgrid_horizon, dirpath+'/core_ANOVA_byHorizon', summary_format)
+    ResearchModules.save_summary(
+        statgrid_time, dirpath+'/core_ANOVA_byTimepoint', summary_format)
     
 #%%
 ####################
@@ -175,5 +183,6 @@ if __name__ == '__main__':
     data, dirpath = importData()
     depthAnalysis(data, dirpath)
     ANOVA(data, dirpath)
+    ResearchModules.wait_for_summaries()
     
 
@@ -15,9 +15,8 @@ Compares manual measurements to USGS logged lake depth measurements
 # IMPORTS
 ####################
 
-import ResearchModules
+import GSLMO_datasets
 import os
-import pandas as pd
 
 
 ####################
@@ -26,17 +25,18 @@ import pandas as pd
 siteB_elev_assumed = 1277.26
 siteB3_elev_assumed = 1276.55
 
+# Datasets (see GSLMO_datasets.py) and their depth columns
 files = {
     'Saltair'   : {
-        'dt_col'    : '20d',
+        'dataset'   : 'elevation_Saltair',
         'depth_col' : 'm'
         },
     'Causeway'  : {
-        'dt_col'    : '20d',
+        'dataset'   : 'elevation_Causeway',
         'depth_col' : 'm'
         },
     'manual'    : {
-        'dt_col'    : 'Datetime',
+        'dataset'   : 'manual_data',
         'depth_col' : 'water_depth_m'
         }
     }
@@ -48,19 +48,14 @@ files = {
 if __name__ == '__main__': 
 
     # Load in files
-    dirpath = os.getcwd()
+    catalog = GSLMO_datasets.DatasetCatalog(data_dir = os.getcwd(), ask = True)
     for file in list(files):
-        # Load in file
-        filename, dirpath, data = ResearchModules.fileGet(
-            'Select file with ' + file + ' data (csv)', directory=dirpath)
-        # Set index
-        data.set_index(files[file]['dt_col'], inplace=True)
-        # Format timestamp
-        data.index = pd.to_datetime(data.index, errors='coerce')
-        # Format the rest
-        data = pd.to_numeric(data[files[file]['depth_col']], errors='coerce')
-        # Resample to 15 minute intervals
+        # Get the numeric depth column
+        data = catalog.series(files[file]['dataset'],
+                              files[file]['depth_col'])
+        # Resample to daily means
         files[file]['data'] = data.dropna().to_frame().resample('1D').mean()
+    dirpath = catalog.data_dir
 
     # Merge on timeseries and create combined file
     data_merged = files['manual']['data'].copy()
@@ -18,6 +18,7 @@ Builds plots of Great Salt Lake elevation in the context of historical trends.
 ####################
 import os
 import io
+import re
 import requests
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -42,6 +43,12 @@ date_start = "1847-10-18"   # Start date for data grab
                             # Start of reconstructed history for Saltair
                             # is 1847-10-18
 date_end = today            # End date for data grab; default = today
+
+# RDB response parsing
+# Value columns are named <ts_id>_<parameter>_<statistic>, with qualifier
+# columns ending in '_cd'. Instantaneous values have no statistic code.
+rdb_col_pattern = re.compile(r'^\d+_(\d{5})(?:_(\d{5}))?(_cd)?$')
+rdb_datefmts = {10 : '%Y-%m-%d', 16 : '%Y-%m-%d %H:%M'}
       
                       
 ### Data analysis time periods
@@ -190,51 +197,24 @@ def fetchData(station_id = station_id, parameter_code = parameter_code,
             f"Failed to fetch data from USGS. Status code: {response.status_code}..."
             )
     
-    # Parse the returned RDB format
-    # Filter out comments (lines starting with '#')
-    lines = response.text.splitlines()
-    data_lines = [line for line in lines if not line.startswith("#")]
+    # Parse the returned RDB format straight into typed columns
+    raw_df = parseRDB(response.text, parameter_code = parameter_code)
     
-    if len(data_lines) < 2:
+    if raw_df.empty:
         # Return error if no data
         print(
             f"No data returned for site {station_id} with parameter {parameter_code}"
             )
-        df = pd.DataFrame()
-    else:
-        # Extract the header row and skip the row-definition column
-        header = data_lines[0]
-        records = data_lines[2:]
-        clean_tsv_data = "\n".join([header] + records)
-        # Convert tsv to csv
-        raw_df = pd.read_csv(io.StringIO(clean_tsv_data), sep="\t")
+        return pd.DataFrame()
         
-    # Dynamically isolate and clean columns
-    # USGS column headers for values contain the parameter code but append a statistic suffix (e.g., '_62614_00003')
+    # Value columns are named by parameter code and statistic code
+    # (e.g., '62614_00003'), with qualifiers in the matching '_cd' column
     val_col = [
         col
         for col in raw_df.columns
-        if f"_{parameter_code}_" in col and not col.endswith("_cd")
-    ]
-    cd_col = [
-        col
-        for col in raw_df.columns
-        if f"_{parameter_code}_" in col and col.endswith("_cd")
+        if col.split("_")[0] == parameter_code and not col.endswith("_cd")
     ]
 
-    # Flexible fallback if the column string structure differs
-    if not val_col:
-        val_col = [
-            col
-            for col in raw_df.columns
-            if parameter_code in col and not col.endswith("_cd")
-        ]
-        cd_col = [
-            col
-            for col in raw_df.columns
-            if parameter_code in col and col.endswith("_cd")
-        ]
-
     if not val_col:
         raise ValueError(
             f"Could not locate value column matching parameter code {parameter_code}"
@@ -242,10 +222,10 @@ def fetchData(station_id = station_id, parameter_code = parameter_code,
 
     # Standardize the DataFrame
     df = pd.DataFrame()
-    df["Date"] = pd.to_datetime(raw_df["datetime"])
-    df["Elevation"] = pd.to_numeric(raw_df[val_col[0]], errors="coerce")
-    if cd_col:
-        df["Quality_Code"] = raw_df[cd_col[0]]
+    df["Date"] = raw_df["datetime"]
+    df["Elevation"] = raw_df[val_col[0]]
+    if val_col[0] + "_cd" in raw_df.columns:
+        df["Quality_Code"] = raw_df[val_col[0] + "_cd"]
 
     # Drop any records with missing elevation data and sort chronologically
     df = df.dropna(subset=["Elevation"]).sort_values("Date").reset_index(drop=True)
@@ -256,6 +236,122 @@ def fetchData(station_id = station_id, parameter_code = parameter_code,
 
 
 
+def parseRDB(text, parameter_code = None, statistic_code = None):
+    '''
+    Parses a USGS RDB (tab-delimited) response into typed columns without
+    splitting the response into lines. Handles responses containing several
+    sites, each with its own '#' comment block, header row, and
+    type-definition row.
+
+    Parameters
+    ----------
+    text : str
+        Text of the RDB response.
+    parameter_code : str, optional
+        Only read value columns for this USGS parameter code.
+        The default is None, which reads all parameters.
+    statistic_code : str, optional
+        Only read value columns for this USGS statistic code (e.g., '00003'
+        for the daily mean). The default is None, which reads all statistics.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Table with the columns site_no (categorical), datetime (datetime64),
+        and a value (float32) and qualifier (categorical) column for each
+        parameter/statistic, named "<parameter>_<statistic>" and
+        "<parameter>_<statistic>_cd" (just "<parameter>" for instantaneous
+        values, which have no statistic code).
+
+    '''
+    buf = io.StringIO(text)
+    blocks = []
+    pos = 0
+    while pos < len(text):
+        # Skip the '#' comment block
+        if text.startswith('#', pos):
+            pos = _nextLine(text, pos)
+            continue
+
+        # Header row, then the type-definition row (e.g., '5s  15s  20d')
+        header_end = _nextLine(text, pos)
+        header = text[pos:header_end].rstrip('\r\n').split('\t')
+        data_start = _nextLine(text, header_end)
+
+        # Data rows run until the next site's comment block
+        data_end = text.find('\n#', data_start)
+        data_end = len(text) if data_end < 0 else data_end + 1
+        nrows = text.count('\n', data_start, data_end)
+        if data_end > data_start and not text.endswith('\n', 0, data_end):
+            nrows += 1
+        pos = data_end
+        if not nrows:
+            continue
+
+        # Map value & qualifier columns by parameter & statistic code
+        colmap = {}
+        for col in header:
+            match = rdb_col_pattern.match(col)
+            if not match:
+                continue
+            param, stat, cd = match.groups()
+            if parameter_code and param != parameter_code:
+                continue
+            if statistic_code and stat != statistic_code:
+                continue
+            colmap[col] = param + ('_' + stat if stat else '') + (cd or '')
+        usecols = [col for col in ['site_no', 'datetime'] if col in header]
+        usecols = usecols + list(colmap)
+
+        # Decode the block straight from the shared buffer
+        dtypes = {col : ('category' if col.endswith('_cd') else 'float32')
+                  for col in colmap}
+        dtypes.update({'site_no' : 'category', 'datetime' : str})
+        buf.seek(data_start)
+        try:
+            block = pd.read_csv(buf, sep = '\t', header = None, names = header,
+                                usecols = usecols, nrows = nrows,
+                                dtype = dtypes, na_values = [''],
+                                keep_default_na = False)
+        except ValueError:
+            # Value columns containing text (e.g., 'Ice') are coerced to NaN
+            buf.seek(data_start)
+            block = pd.read_csv(buf, sep = '\t', header = None, names = header,
+                                usecols = usecols, nrows = nrows, dtype = str)
+            for col in colmap:
+                if col.endswith('_cd'):
+                    block[col] = block[col].astype('category')
+                else:
+                    block[col] = pd.to_numeric(
+                        block[col], errors = 'coerce').astype('float32')
+            block['site_no'] = block['site_no'].astype('category')
+
+        # Convert timestamps using the RDB date format for the value length
+        datefmt = rdb_datefmts.get(len(block['datetime'].iloc[0]))
+        block['datetime'] = pd.to_datetime(block['datetime'], format = datefmt)
+        blocks.append(block.rename(columns = colmap))
+
+    if not blocks:
+        return pd.DataFrame()
+    if len(blocks) == 1:
+        return blocks[0]
+
+    # Combine sites, restoring categorical types lost to differing categories
+    df = pd.concat(blocks, ignore_index = True)
+    for col in df.columns:
+        if col == 'site_no' or col.endswith('_cd'):
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+def _nextLine(text, pos):
+    '''Returns the position of the start of the line following pos'''
+    end = text.find('\n', pos)
+    return len(text) if end < 0 else end + 1
+
+
+
 def interpolateElev(elev_data):
     '''
     Resamples elevation data to return resampled daily data and interpolated
@@ -10,7 +10,6 @@ Created on Sat Nov 12 15:14:58 2022
 ####################
 
 import ResearchModules
-import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
@@ -49,18 +48,21 @@ date_ranges = [
 if __name__ == '__main__':
     # Import weather data files
     filename, dirpath, data = ResearchModules.fileGet(
-        'Select file with merged weather data from both stations (csv)')
+        'Select file with merged weather station data (csv)')
     
     # Format timestamp
-    data.index = pd.to_datetime(data.index, errors='coerce')
+    data.index = ResearchModules.parse_timestamps(data.index)
     
-    # Resample to daily grabbing precip accum. max
-    data_cols = [col for col in data.columns if precip_col in col]
+    # Resample to daily grabbing precip accum. max of each station and of
+    # the merged average (combine_weather_stations.py column names)
+    data_cols = ([station + '_' + precip_col for station in stations]
+                 + ['avg_' + precip_col])
     daily_data = data[data_cols].resample('1d').max()
     
     # Convert in to cm
-    data_conv_cols = [col.replace('in','cm') for col in data_cols]
-    daily_data[data_conv_cols] = ResearchModules.inch_to_cm(daily_data)
+    conv_cols = {col : col.replace('(in)','(cm)') for col in data_cols}
+    daily_data[list(conv_cols.values())] = ResearchModules.convert_units(
+        daily_data[data_cols].to_numpy(), 'inch_to_cm')
     
     # Save data
     daily_data.to_csv(dirpath + '/daily_precip.csv')
@@ -68,10 +70,10 @@ if __name__ == '__main__':
     # Plot daily rain
     fig, ax = plt.subplots(figsize=plotsize_default)
     legend = []
-    for n, station in enumerate(stations):
+    for station in stations:
         ResearchModules.plotData(
-            daily_data, 'index', data_conv_cols[n], 'Date',
-            'Accumulated precip. (cm)', 'Precipitation', ax=ax,
+            daily_data, 'index', conv_cols[station + '_' + precip_col],
+            'Date', 'Accumulated precip. (cm)', 'Precipitation', ax=ax,
             xtype='datetime', datefmt='%m/%d/%Y %H:%M:%S')
         legend.append(station)
     ax.legend(legend)
@@ -80,14 +82,10 @@ if __name__ == '__main__':
     fig.savefig(dirpath + '/daily_precip.png')
     fig.savefig(dirpath + '/daily_precip.svg')
     
-    # Calc sum for each date range
-    date_sums = pd.DataFrame(
-        index=list(range(len(date_ranges))),
-        columns=['date_start','date_end','sum','avg','stdev'])
-    for n,dates in enumerate(date_ranges):
-        date_sums.loc[n,'date_start'] = dates[0]
-        date_sums.loc[n,'date_end'] = dates[1]
-        date_sums.loc[n,'sum'] = daily_data.loc[dates[0]:dates[1]]['avg_' + precip_col].sum()
-        date_sums.loc[n,'avg'] = daily_data.loc[dates[0]:dates[1]]['avg_' + precip_col].mean()
-        date_sums.loc[n,'stdev'] = daily_data.loc[dates[0]:dates[1]]['avg_' + precip_col].std()
+    # Calc sum, avg, & stdev for each date range
+    date_sums = ResearchModules.interval_stats(
+        ResearchModules.interval_prefix_sums(
+            daily_data['avg_' + precip_col]),
+        date_ranges)
+    date_sums = date_sums[['date_start','date_end','sum','avg','stdev']]
     date_sums.to_csv(dirpath + '/precip_stats.csv')
@@ -10,7 +10,10 @@ and HOBO logger data. The script requires files for all of the combined HOBO
 logger data, plus Saltair & Causeway elevation files.
 
 Builds static plots and interactive (plotly) plots, as well as an HTML
-dashboard containing the plotly plots.
+dashboard containing the plotly plots. The dashboard loads one shared copy
+of plotly.js (saved next to it), draws long series with WebGL, and only
+draws each plot when it is scrolled into view. If playwright is installed,
+the page load is checked in a headless browser.
 
 Functions are in place to summarize the data, but they are buggy right now.
 
@@ -29,12 +32,13 @@ HOBO files need to have columns renamed to:
 # IMPORTS
 ####################
 import ResearchModules
+import GSLMO_datasets
 import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import numpy as np
 import plotly.express as px
+from plotly.offline import get_plotlyjs
 from datetime import date
 
 ####################
@@ -45,6 +49,8 @@ plotsize_default = (12,6)
 resample_interval = '1d'
 smooth_interval = '7d'
 div_pfx = 'plotly_'
+plotly_js = 'plotly.min.js' # Shared plotly library, saved next to the page
+webgl_min_points = 5000 # Draw series with at least this many points in WebGL
 
 # Formatting for datetime axis
 years = mdates.YearLocator()
@@ -151,44 +157,8 @@ dset_groups = {
         }
     }
 
-# Files to draw from
-files = {
-    'elevation_Saltair' : {
-        'title' : 'Elevation at Saltair (USGS)',
-        'xcol'  : '20d',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        },
-    'elevation_Causeway' : {
-        'title' : 'Elevation at Causeway (USGS)',
-        'xcol'  : '20d',
-        'datefmt'   : '%m/%d/%Y %H:%M'
-        },
-    'site_A_pend' : {
-        'title' : 'Site A Pendant',
-        'xcol'  : 'Datetime',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        },
-    'site_A_butt_A' : {
-        'title' : 'Site A Button A (top)',
-        'xcol'  : 'Datetime',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        },
-    'site_B_pend' : {
-        'title' : 'Site B Pendant',
-        'xcol'  : 'Datetime',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        },
-    'site_B_butt_B' : {
-        'title' : 'Site B Button B (top)',
-        'xcol'  : 'Datetime',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        },
-    'site_B_butt_C' : {
-        'title' : 'Site B Button C (side)',
-        'xcol'  : 'Datetime',
-        'datefmt' : '%m/%d/%Y %H:%M'
-        }
-    }
+# Datasets to draw from (see GSLMO_datasets.py); each file is asked for
+catalog = GSLMO_datasets.DatasetCatalog(data_dir = os.getcwd(), ask = True)
 
 
 ####################
@@ -197,17 +167,17 @@ files = {
 
 def loadFiles():
     '''
-    Loads in the files for the dataset
+    Asks for the file for each dataset used by dset_groups and loads it into
+    the catalog (timestamps are parsed with the dataset's datefmt). The
+    hourly, unit-converted columns used by the plots and summaries are
+    calculated from the catalog the first time they are needed, once each.
     '''
-    # Load in files
-    dirpath = os.getcwd()
-    for file in files:
-        # Load in the file
-        filename, dirpath, data = ResearchModules.fileGet(
-            'Select file with data for ' + files[file]['title'], directory=dirpath)
-        files[file]['raw_data'] = data
+    for file in dict.fromkeys(
+            dset_groups[dset]['datasets'][var]['file']
+            for dset in dset_groups for var in dset_groups[dset]['datasets']):
+        catalog.load(file)
     
-    return dirpath
+    return catalog.data_dir
 
 
 def buildPlots(dirpath):
@@ -238,25 +208,52 @@ def buildPlots(dirpath):
         fig.savefig(dirpath + '/' + dset + '.png')
         fig.savefig(dirpath + '/' + dset + '.svg')
         
-        # Build interactive plot
+        # Build interactive plot (WebGL for long series); save the figure
+        # data only, the dashboard page supplies plotly.js
         fig = px.line(data, x=data.index, y=data.columns, title = None,
                       labels = {
                                 'Timestamp' : 'Date',
                                 'value'     : dset_groups[dset]['ytitle'],
                                 'variable'  : 'data source'
-                                })
-        fig.write_html(dirpath + '/' + div_pfx + dset + '.html', full_html=False)
+                                },
+                      render_mode = ('webgl' if len(data) >= webgl_min_points
+                                     else 'svg'))
+        with open(dirpath + '/' + div_pfx + dset + '.json', 'wt',
+                  encoding = 'utf-8') as file:
+            file.write(fig.to_json())
         
         
 def buildHTML(dirpath):
+    '''
+    Builds the dashboard page from the figures saved by buildPlots. The page
+    references one shared copy of plotly.js, and each figure is drawn when
+    its section scrolls into view.
+
+    Parameters
+    ----------
+    dirpath : str
+        Directory containing the figure files; the page is saved here.
+
+    Returns
+    -------
+    page_bytes : int
+        Size of the page plus the shared plotly.js file, in bytes.
+
+    '''
     print('Building HTML Dashboard...')
-    
+
+    # Save the shared plotly.js library
+    with open(dirpath + '/' + plotly_js, 'wt', encoding='utf-8') as file:
+        file.write(get_plotlyjs())
+
     # Set up HTML page
     html_head = ('''
     <!doctype html>
     <html>
     <head>
         <title>GSLMO Dashboard</title>
+        <meta charset="utf-8" />
+        <script src="''' + plotly_js + '''"></script>
     </head>
     <body>
         <h1>Great Salt Lake Microbialite Observatory Dashboard</h1>
@@ -268,52 +265,118 @@ def buildHTML(dirpath):
 
     html_body = ''
     html_foot = '''
+    <script>
+    // Draw each plot the first time it scrolls into view
+    var observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (!entry.isIntersecting) { return; }
+            var div = entry.target;
+            observer.unobserve(div);
+            var fig = JSON.parse(
+                document.getElementById(div.id + '_data').textContent);
+            Plotly.newPlot(div, fig.data, fig.layout, {responsive: true});
+        });
+    }, {rootMargin: '200px'});
+    document.querySelectorAll('.lazy-plot').forEach(function(div) {
+        observer.observe(div);
+    });
+    </script>
     </body>
     </html>
     '''
-    
-    # Load in and append html figure div for each dataset
+
+    # Load in and append the figure data & a placeholder div for each dataset
     for dset in dset_groups:
-        # Load in and append html
-        with open(dirpath + '/' + div_pfx + dset + '.html', 'r', encoding = 'UTF-8') as file:
-            div_html = file.read()
+        with open(dirpath + '/' + div_pfx + dset + '.json', 'r',
+                  encoding = 'UTF-8') as file:
+            fig_json = file.read()
         html_body = (
             html_body + '\n'
             + '<h1>' + dset_groups[dset]['title'] + '</h1>'
-            + '\n'   + div_html)
-        
+            + '\n<div id="' + div_pfx + dset
+            + '" class="lazy-plot" style="height:450px"></div>'
+            + '\n<script type="application/json" id="' + div_pfx + dset
+            + '_data">' + fig_json.replace('</', '<\\/') + '</script>')
+
     # Write the combined HTML file
     html_fullpage = html_head + '\n' + html_body + '\n' + html_foot
     with open(
             dirpath + '/' + 'GSLMO_dashboard.html','wt',
             encoding='utf-8') as file:
         file.write(html_fullpage)
-    
-    
+
+    # Report the page size
+    page_bytes = (os.path.getsize(dirpath + '/GSLMO_dashboard.html')
+                  + os.path.getsize(dirpath + '/' + plotly_js))
+    print('   Dashboard size: ' + str(round(page_bytes/1e6, 2))
+          + ' MB (including ' + plotly_js + ')')
+    return page_bytes
+
+
+def checkDashboard(dirpath, timeout=60):
+    '''
+    Opens the dashboard in a headless browser (requires playwright) and
+    measures how long it takes for the first plot to be drawn (time to
+    interactive) and for all plots to be drawn after scrolling through the
+    page.
+
+    Parameters
+    ----------
+    dirpath : str
+        Directory containing GSLMO_dashboard.html.
+    timeout : int, optional
+        Seconds to wait for the plots. The default is 60.
+
+    Returns
+    -------
+    timings : dict or None
+        'first_plot_ms' and 'all_plots_ms' after the page starts loading,
+        or None if playwright is not installed.
+
+    '''
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print('   Install playwright to check the dashboard load time.')
+        return None
+
+    url = 'file://' + os.path.abspath(dirpath + '/GSLMO_dashboard.html')
+    n_plots = len(dset_groups)
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        page = browser.new_page()
+        page.goto(url)
+        page.wait_for_function(
+            'document.querySelectorAll(".js-plotly-plot").length > 0',
+            timeout = timeout*1000)
+        first_plot_ms = page.evaluate('performance.now()')
+        # Scroll each plot into view to draw it
+        for div in page.query_selector_all('.lazy-plot'):
+            div.scroll_into_view_if_needed()
+        page.wait_for_function(
+            'document.querySelectorAll(".js-plotly-plot").length >= '
+            + str(n_plots), timeout = timeout*1000)
+        all_plots_ms = page.evaluate('performance.now()')
+        browser.close()
+
+    timings = {'first_plot_ms'  : round(first_plot_ms),
+               'all_plots_ms'   : round(all_plots_ms)}
+    print('   Time to first plot: ' + str(timings['first_plot_ms'])
+          + ' ms; all plots: ' + str(timings['all_plots_ms']) + ' ms')
+    return timings
+
+
 
 def formatConvertSmoothData(dset, var, ycol_name):
+    '''Returns hourly values for a dataset, converted to the plot units
+    (calculated once per dataset by the catalog)'''
     # Get the data
     file = dset_groups[dset]['datasets'][var]['file']
-    xcol = files[file]['xcol']
     ycol = dset_groups[dset]['datasets'][var]['ycol']
-    data = files[file]['raw_data'][[xcol,ycol]].copy()
     convert = dset_groups[dset]['datasets'][var]['conv']
     
-    # Format the data
-    data.columns = ['Timestamp', ycol_name]
-    print('      Converting timestamps for ' + var + '...')
-    data['Timestamp'] = pd.to_datetime(data['Timestamp'])
-    data[ycol_name] = pd.to_numeric(data[ycol_name], errors='coerce')
-    data.set_index('Timestamp', inplace=True)
-    
-    # Resample the data to hourly values
-    smoothed_hourly = data.resample('1H').mean()
-    
-    # Convert units if needed
-    if convert:
-        fctn = getattr(ResearchModules, convert)
-        smoothed_hourly[ycol_name] = [fctn(x)
-                                    for x in smoothed_hourly[ycol_name]]
+    hourly = catalog.series(file, ycol, convert, '1h')
+    smoothed_hourly = hourly.rename_axis('Timestamp').to_frame(ycol_name)
         
     return smoothed_hourly
 
@@ -330,14 +393,13 @@ def buildSummaries(dirpath):
 
     Returns
     -------
-    None.
+    data_summary : pandas.DataFrame
+        Summary statistics for each dataset ('group: dataset'), also saved
+        as timeseries_data_summary.csv.
 
     '''
-    # Set up the summary
-    data_summary = pd.DataFrame(
-        columns=['Dataset','min_val','min_date','max_val','max_date','median',
-                 'avg','stdev'])
-    data_summary.set_index('Dataset',inplace=True)
+    # Hourly series to summarize
+    summary_series = {}
     
     # Go through data groups and plot static figures, generate summaries
     for dset in dset_groups:
@@ -351,42 +413,20 @@ def buildSummaries(dirpath):
         # Plot each line
         for var in dset_groups[dset]['datasets']:
             print ('   Processing ' + var + '...')
-            # Get the data
+            # Get the hourly data, converted to the plot units
             file = dset_groups[dset]['datasets'][var]['file']
-            xcol = files[file]['xcol']
-            ycol = dset_groups[dset]['datasets'][var]['ycol']
-            data = files[file]['raw_data'][[xcol,ycol]].copy()
-            convert = dset_groups[dset]['datasets'][var]['conv']
+            smoothed_hourly = formatConvertSmoothData(dset, var, 'ydata')
             
-            # Format the data
-            data.columns = ['Timestamp','ydata']
-            print('      Converting timestamps for ' + var + '...')
-            data['Timestamp'] = pd.to_datetime(data['Timestamp'])
-            data['ydata'] = pd.to_numeric(data['ydata'], errors='coerce')
-            data.set_index('Timestamp', inplace=True)
-            
-            # Resample the data to hourly values
-            smoothed_hourly = data.resample('1H').mean()
-            
-            # Convert units if needed
-            if convert:
-                fctn = getattr(ResearchModules, convert)
-                smoothed_hourly['ydata'] = [fctn(x)
-                                            for x in smoothed_hourly['ydata']]
-            
-            # Summarize data
+            # Save the hourly data & keep it for the summary
             smoothed_hourly.to_csv(dirpath + var + '_smoothed-hourly.csv')
-            data_summary.loc[var] = summarize_data(smoothed_hourly)
-            data_summary.to_csv(
-                dirpath + '/timeseries_data_summary_' + dset + '_' + var
-                + '.csv')
+            summary_series[dset + ': ' + var] = smoothed_hourly['ydata']
 
             # Plot the data
-            ResearchModules.plotData(smoothed_hourly, 'index', 'ydata',
-                                     'Date', dset_groups[dset]['ytitle'], var,
-                                     ax=ax, plotsize=plotsize_default,
-                                     smooth=True, xtype='datetime',
-                                     datefmt=files[file]['datefmt'])
+            ResearchModules.plotData(
+                smoothed_hourly, 'index', 'ydata', 'Date',
+                dset_groups[dset]['ytitle'], var, ax=ax,
+                plotsize=plotsize_default, smooth=True, xtype='datetime',
+                datefmt=catalog.datasets[file]['datefmt'])
             
             # Add to legend
             legend.append(var)
@@ -400,59 +440,12 @@ def buildSummaries(dirpath):
         fig.savefig(dirpath + '/' + dset + '.png')
         fig.savefig(dirpath + '/' + dset + '.svg')
 
+    # Summarize all of the data at once & save the summary
+    data_summary = ResearchModules.summarize_series(summary_series)
+    data_summary.to_csv(dirpath + '/timeseries_data_summary.csv')
     
+    return data_summary
 
-def summarize_data(data, dt_range='all', time_col='index', ycol='ydata'):
-    '''
-    Summarizes timeseries data, determining:
-        min & max values and dates they occurred
-        median, average, and stdev
-    
-    Parameters
-    ----------
-    data : pandas.DataFrame
-        Dataframe containing the data.
-    dt_range : list, optional
-        List containing two timestamps: [start, end]. The default is 'all',
-        which analyzes all timestamps.
-    time_col : string, optional
-        Name of the column containing the timestamps.
-        The default is 'index'
-    ycol : string, optional
-        Name of the column containing the y data. The default is 'ydata'.
-
-    Returns
-    -------
-    data_summary : list
-        List containing the following summary statistics
-            1. min value
-            2. date(s) when minimum was reached
-            3. max value
-            4. date(s) when max was reached
-            5. median value
-            6. average value
-            7. standard deviation
-
-    '''
-    # Format the data
-    if time_col=='index':
-        df = pd.DataFrame(data[ycol])
-    else:
-        df = data[[time_col, ycol]].copy()
-        df.set_index(time_col, inplace=True)
-    
-    # Calculate summary stats
-    min_val = min(df[ycol])
-    min_date = str(list(set([n.strftime('%Y-%m-%d')
-                for n in list(df[df[ycol]==min_val].index)])))
-    max_val = max(df[ycol])
-    max_date = str(list(set([n.strftime('%Y-%m-%d')
-                for n in list(df[df[ycol]==max_val].index)])))
-    median = np.nanmedian(data[ycol])
-    average = np.nanmean(data[ycol])
-    stdev = np.std(data[ycol])
-    
-    return [min_val, min_date, max_val, max_date, median, average, stdev]
 
 #%%
 ####################
@@ -464,8 +457,9 @@ if __name__ == '__main__':
     dirpath = loadFiles()
     # Build the summary plots
     buildPlots(dirpath)
-    # Build the interactive plot HTML page
+    # Build the interactive plot HTML page & check how fast it loads
     buildHTML(dirpath)
+    checkDashboard(dirpath)
     
 
     
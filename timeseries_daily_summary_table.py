@@ -12,52 +12,50 @@ Condenses timeseries data to daily summary table
 # IMPORTS
 ####################
 
-import ResearchModules
+import GSLMO_datasets
 import os
 import pandas as pd
-import numpy as np
-from tkinter import *
-from tkinter import filedialog
 
 
 ####################
 # VARIABLES
 ####################
+# Sheets of the compiled timeseries workbook to summarize (the sheet formats
+# are in GSLMO_datasets.py)
 dsets = {
     'elevation'     : {
         'title'     : 'Elevation (m)',
         'sheets'    : ['GSL_elevation_Saltair','GSL_elevation_Causeway'],
-        'datecol'   : 'Datetime',
         'datacol'   : 'Elevation (m)',
-        'headrow'   : 3,
         'summarize' : ['daily_mean']
         },
     'temperature'   : {
         'title'     : 'Temperature (\degC)',
         'sheets'    : ['HOBO_pendant','HOBO_button_top','HOBO_button_side'],
-        'datecol'   : 'Datetime',
         'datacol'   : 'Temperature (°C)',
-        'headrow'   : 3,
         'summarize' : ['daily_mean']
         },
     'light'         : {
         'title'     : 'Irradiance (lux)',
         'sheets'    : ['HOBO_button_top'],
-        'datecol'   : 'Datetime',
         'datacol'   : 'Irradiance (lux)',
-        'headrow'   : 3,
         'summarize' : ['daily_mean','daily_max']
         },
     'precip'        : {
         'title'     : 'Precipitation (cm)',
         'sheets'    : ['KUTSYRAC22','KUTSYRAC27'],
-        'datecol'   : 'Datetime',
         'datacol'   : 'Precip. Accum (cm)',
-        'headrow'   : 2,
         'summarize' : ['daily_accumulated']
         }
     }
 
+# Daily summaries: {summary name : (pandas aggregation, column label)}
+summaries = {
+    'daily_mean'        : ('mean', 'daily mean'),
+    'daily_max'         : ('max', 'daily max'),
+    'daily_accumulated' : ('max', 'daily accumulated')
+    }
+
 date_min = '2019-01-01'
 date_max = '2022-12-01'
 
@@ -68,70 +66,45 @@ date_max = '2022-12-01'
 
 def importData():
     '''
-    Imports the spreadsheet, returns pandas.DataFrame containing the core data.
+    Imports the workbook sheets used by dsets, returns a dict of
+    pandas.DataFrames (indexed by timestamp) and the workbook directory.
     '''
-    # Get list of sheets to import
-    sheet_list = []
-    for ds in dsets:
-        sheet_list=sheet_list+dsets[ds]['sheets']
-    sheet_list = list(set(sheet_list))
-    
-    # Open user input file dialog to pick file
-    root=Tk()
-    filename = filedialog.askopenfilename(
-        initialdir = os.getcwd(),
-        title = 'Select compiled timeseries data file',
-        filetypes = [('Excel', '*.xls, *.xlsx')])
-    dirpath = os.path.dirname(filename)     # Directory
-    root.destroy()
-    
-    # Import sheets
+    # The workbook is asked for once and each sheet is read once
+    catalog = GSLMO_datasets.DatasetCatalog(data_dir = os.getcwd(), ask = True)
     sheets = {}
     for ds in dsets:
         for sheet in dsets[ds]['sheets']:
             if not sheet in sheets:
                 print('Reading in ' + sheet + '...')
-                sheets[sheet] = pd.read_excel(
-                    filename, sheet_name = sheet,
-                    header = dsets[ds]['headrow'],
-                    index_col = dsets[ds]['datecol'])
+                sheets[sheet] = catalog.load('workbook_' + sheet)
     
-    return sheets, dirpath
+    return sheets, catalog.data_dir
 
 def summarizeData(sheets, dirpath):
-    summary_table = pd.DataFrame()
-    for ds in dsets:   
-        # Grab the data
+    '''
+    Summarizes each sheet's data column by day, running all of its summaries
+    in a single resample pass, and saves the table.
+    '''
+    columns = []
+    for ds in dsets:
+        funcs = [summaries[summary][0] for summary in dsets[ds]['summarize']]
         for sheet in dsets[ds]['sheets']:
-            data = sheets[sheet]
-            data.index = pd.to_datetime(data.index, errors='coerce')
-            data = data[date_min:date_max][dsets[ds]['datacol']].copy()
+            # Grab the data
+            datacol = dsets[ds]['datacol']
+            data = sheets[sheet].loc[date_min:date_max, datacol]
             data = pd.to_numeric(data, errors='coerce')
+            # Run each aggregation once per day
+            daily = data.resample('D').agg(list(dict.fromkeys(funcs)))
             for summary in dsets[ds]['summarize']:
-                # Determine and run the type of summary
-                data_summarized = eval(summary + '(data, sheet)')
-                # Add to the table
-                summary_table = pd.concat([summary_table, data_summarized], axis = 1, join='outer')
+                func, label = summaries[summary]
+                columns.append(daily[func].rename(
+                    sheet + ' ' + label + ' ' + datacol))
             
     # Save the table
+    summary_table = pd.concat(columns, axis = 1, join='outer')
     summary_table.to_excel(dirpath + '/timeseries_daily_summary.xlsx')
-
-def daily_mean(data, sheet):
-    data_summarized = data.resample('d').mean()
-    data_summarized.name = sheet + ' daily mean ' + data.name
-    return data_summarized
     
-def daily_max(data, sheet):
-    data_summarized = data.resample('d').max()
-    data_summarized.name = sheet + ' daily max ' + data.name
-    return data_summarized
-    
-def daily_accumulated(data, sheet):
-    data_summarized = data.resample('d').max()
-    data_summarized.name = sheet + ' daily accumulated ' + data.name
-    return data_summarized
-    
-
+    return summary_table
 
 
 #%%
@@ -14,9 +14,9 @@ HOBO logger data, summarizes it for different time periods, and plots it.
 Arguments:  None
 
 Requirements: Need csv files for elevation, temperature, light, and pressure,
-    as well as manual field measurements. See the variables 'plots' and 'files'
-    in the code for details of formatting, and edit according to how the files
-    are formatted.    
+    as well as manual field measurements. See the variable 'plots' in the
+    code and the dataset catalog in GSLMO_datasets.py for details of
+    formatting, and edit according to how the files are formatted.
 
 Example in command line:
     python timeseries_plots.py
@@ -31,6 +31,7 @@ You will also need to have the following files
     in the same directory as this script.
     They contain modules and variables that this script calls.
     ResearchModules.py
+    GSLMO_datasets.py
 If you get an error indicating that one of these modules is not found,
     change the working directory to the directory containing these files.
 
@@ -65,10 +66,15 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>
 ####################
 
 import ResearchModules
+import GSLMO_datasets
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib
+from concurrent.futures import ProcessPoolExecutor
 matplotlib.rcParams['pdf.fonttype'] = 42
 matplotlib.rcParams['ps.fonttype'] = 42
 # from datetime import datetime
@@ -80,6 +86,8 @@ matplotlib.rcParams['ps.fonttype'] = 42
 
 # Plot default variables
 plotsize_default = (12, 4)
+# Processes rendering the figures (None = one per CPU)
+plot_workers = None
 
 # Formatting for datetime axis
 years = mdates.YearLocator()
@@ -98,6 +106,9 @@ date_ranges = [
     ['2022-07-12', '2022-10-20']
 ]
 
+# Summary file format: 'csv' or 'parquet' (one tidy table) or 'xlsx'
+summary_format = 'csv'
+
 # Plots to generate
 plots = {
     'elev': {
@@ -382,331 +393,242 @@ plots = {
         }
     }
 
-# Datasets to draw from
-dirpath = (
-    'G:/My Drive/Teaching, Research, Etc/Research/Great Salt Lake/' + 
-    '2022 Microbialite Desiccation Bio Paper/Timeseries Field & Logger Data')
-files = {
-    'elevation_Saltair': {
-        'title': 'Elevation at Saltair (USGS)',
-        'xcol': '20d',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'Elev_Saltair_071001-220925.csv'
-        },
-    'elevation_Causeway': {
-        'title': 'Elevation S of RR causeway near Lakeside (USGS)',
-        'xcol': '20d',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'Elev_Causeway_191028-221027.csv'
-        },
-    'site_A_pend': {
-        'title': 'Site A Pendant',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'SiteB_Pendant_combined_QC.csv'
-        },
-    'site_A_butt_A': {
-        'title': 'Site A Button A (top)',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'SiteA_ButtonA_combined_QC.csv'
-        },
-    'site_B_pend': {
-        'title': 'Site B Pendant',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'SiteB_Pendant_combined_QC.csv'
-        },
-    'site_B_butt_B': {
-        'title': 'Site B Button B (top)',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'SiteB_ButtonB_combined_QC.csv'
-        },
-    'site_B_butt_C': {
-        'title': 'Site B Button C (side)',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'SiteB_ButtonC_combined_QC.csv'
-        },
-    'manual_data': {
-        'title': 'Manual field measurements',
-        'xcol': 'Datetime',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'field_monitoring_data_fmttd_B.csv'
-        },
-    'site_depths': {
-        'title': 'Calculated field site depths',
-        'xcol': '20d',
-        'datefmt': '%m/%d/%Y',
-        'fname': 'daily_site_depth_calc.csv'
-        },
-    'KUTSYRAC22': {
-        'title': 'KUTSYRAC22 weather station data',
-        'xcol': 'Time',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'KUTSYRAC22_190301-201122.csv'
-        },
-    'KUTSYRAC27': {
-        'title': 'KUTSYRAC27 weather station data',
-        'xcol': 'Time',
-        'datefmt': '%m/%d/%Y %H:%M',
-        'fname': 'KUTSYRAC27_200901-221106.csv'
-        },
-}
+# Datasets to draw from (see GSLMO_datasets.py)
+dirpath = GSLMO_datasets.data_dir
 
 
 ####################
 # FUNCTIONS
 ####################
-def load_files(filelist='auto', files=files, dirpath=dirpath):
+def load_files(filelist='auto', dirpath=dirpath):
     '''
-    Loads in all of the timeseries files
+    Sets up the catalog of timeseries datasets (GSLMO_datasets). Files are
+    loaded when a plot or summary first uses them, and each converted column
+    is calculated once.
 
     Parameters
     ----------
     filelist : str, optional
         'GUI' asks the user to find each file.
-        'auto' pulls files in automatically from filepaths stored as global
-            variables. The default is 'auto'.
-    files : dict of dict, optional
-        dict containing sub-duct fo reach file to load, which each include
-        information needed to load in the file. The default is files, which
-        is defined in the global variables.
+        'auto' pulls files in automatically from dirpath (files that aren't
+            found are asked for). The default is 'auto'.
     dirpath : str, optional
         Directory where files are stored. The default is the dirpath defined
         in the global variables.
 
     Returns
     -------
-    files : dict of dicts
-        Adds imported data to each file set stored in the 'files' variable.
+    data_files : GSLMO_datasets.DatasetCatalog
+        Catalog of the datasets.
+    dirpath : str
+        Directory where files are stored.
 
     '''
-    if filelist == 'auto':
-        # Load in files from pre-defined filepaths
-        print('Loading files...')
-        for file in files:
-            # Load in the file
-            print('Loading file for ' + file + '...')
-            files[file]['data'] = pd.read_csv(dirpath+'/'+files[file]['fname'])
-
-    else:
-        # Load in files by asking user to find them
-        for file in files:
-            # Load in the file
-            filename, dirpath, data = ResearchModules.fileGet(
-                'Select file with data for ' + files[file]['title'],
-                directory=dirpath)
-            files[file]['data'] = data
-
-    # Get list of y_cols
-    y_col_list = []
-    for plot in plots:
-        for var in plots[plot]['datasets']:
-            if plots[plot]['datasets'][var]['ycol'] not in y_col_list:
-                y_col_list.append(plots[plot]['datasets'][var]['ycol'])
+    data_files = GSLMO_datasets.DatasetCatalog(
+        data_dir = dirpath, ask = (filelist == 'GUI'))
+    return data_files, data_files.data_dir
 
-    # Prep data
-    # Convert timestamps
-    for file in files:
-        print('Converting timestamps for ' + file + '...')
-        files[file]['data'].index = pd.to_datetime(
-            files[file]['data'][files[file]['xcol']], errors='coerce')
 
-    # Convert data
-    for plot in plots:
-        for var in plots[plot]['datasets']:
-            print('Converting data for ' + plot + ' ' + var + '...')
-            data = files[plots[plot]['datasets'][var]['file']]['data'][
-                plots[plot]['datasets'][var]['ycol']].copy()
-            # Convert to numeric
-            data = pd.to_numeric(data, errors='coerce')
-            # Convert units
-            if plots[plot]['datasets'][var]['conv'] != 'none':
-                conv = getattr(
-                    ResearchModules, plots[plot]['datasets'][var]['conv'])
-                data = conv(data)
-            files[plots[plot]['datasets'][var]['file']]['data'][
-                plots[plot]['datasets'][var]['ycol'] + '_conv'] = data.copy()
-
-    return files, dirpath
-
-
-def plot_timeseries(data_files, plots=plots, dirpath=dirpath):
+def plot_timeseries(data_files, plots=plots, dirpath=dirpath,
+                    workers=plot_workers):
     '''
-    Plots all of the timeseries specified in plots variable
+    Plots all of the timeseries specified in plots variable. Each figure is
+    described as a job (paths to the data arrays plus the plot styling) and
+    the figures are rendered in parallel processes. The data arrays are
+    saved once to a temporary folder and memory-mapped by the processes
+    rather than sent to them.
 
     Parameters
     ----------
-    data_files : dict of dicts
-        dict of different files, each file dict containing data to plot.
-        This is generated by load_files.
+    data_files : GSLMO_datasets.DatasetCatalog
+        Catalog of the datasets to plot. This is generated by load_files.
     plots : dict of dicts, optional
         dict containing a list of plots to generate. The default is plots,
         which is defined in the global variables.
     dirpath : str
         Directory path for saving figures. The default is dirpath, which was
         defined in the global variables.
+    workers : int, optional
+        Number of processes rendering figures. The default is plot_workers,
+        which is defined in the global variables.
 
     Returns
     -------
-    None.
+    figures : list of str
+        Paths of the saved figures (without the .png/.pdf extension).
 
     '''
-    # Plot figures
-    for plot in plots:
-        print('\nCreating ' + plot + ' figure ...')
-        # Create a new figure
-        fig, ax = plt.subplots(figsize=plotsize_default)
-        legend = []
+    with tempfile.TemporaryDirectory() as arraydir:
+        # Save each timeseries used by the plots once
+        arrays = {}
+        jobs = []
+        for plot in plots:
+            lines = []
+            for var in plots[plot]['datasets']:
+                dset = plots[plot]['datasets'][var]
+                key = (dset['file'], dset['ycol'], dset['conv'])
+                if key not in arrays:
+                    print(' Preparing ' + var + ' (' + dset['file'] + ')...')
+                    ydata = data_files.series(*key)
+                    arrays[key] = {
+                        axis : os.path.join(
+                            arraydir, str(len(arrays)) + '_' + axis + '.npy')
+                        for axis in ['x', 'y']}
+                    np.save(arrays[key]['x'], np.asarray(
+                        ydata.index, dtype='datetime64[ns]'))
+                    np.save(arrays[key]['y'], ydata.to_numpy(
+                        dtype=float, na_value=np.nan))
+                lines.append({
+                    'label'     : var,
+                    'style'     : dset['style'],
+                    'axis'      : dset['axis'],
+                    'ylim'      : dset.get('ylim', 'auto'),
+                    'datefmt'   : data_files.datasets[dset['file']]['datefmt'],
+                    'arrays'    : arrays[key]})
+            jobs.append({
+                'plot'      : plot,
+                'ytitle'    : plots[plot]['ytitle'],
+                'ylim'      : plots[plot]['ylim'],
+                'lines'     : lines,
+                'filename'  : dirpath + '/' + plot})
+
+        # Render the figures
+        print('\nCreating ' + str(len(jobs)) + ' figures...')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            figures = list(executor.map(render_plot, jobs))
+    
+    return figures
 
-        # Plot each dataset
-        for var in plots[plot]['datasets']:
-            print(' Plotting ' + var + '...')
-            # Get the data
-            file = plots[plot]['datasets'][var]['file']
-            dset = data_files[file]['data'].copy()
-            dset['ydata'] = dset[
-                plots[plot]['datasets'][var]['ycol'] + '_conv']
-            dset['dt'] = data_files[file]['data'].index
-
-            # Plot the data
-            # If specified, plot as a scatterplot
-            if plots[plot]['datasets'][var]['style'] == 'dots':
-
-                # If secondary axis specified, create & plot on secondary axis
-                if plots[plot]['datasets'][var]['axis'] == 2:
-                    ax2 = ax.twinx()
-                    ax2 = plt.scatter(dset['dt'], dset['ydata'])
-                    ax_sec = plt.gca()
-                    ax_sec.set_ylabel(var)
-                    ax_sec.set_ylim(plots[plot]['datasets'][var]['ylim'])
-
-                # Otherwise just plot
-                else:
-                    plt.scatter(dset['dt'], dset['ydata'])
-
-            # If scatterplot not specified, assume it's a line plot
-            else:
-                ResearchModules.plotData(
-                    dset, 'dt', 'ydata', 'Date',
-                    plots[plot]['ytitle'], var, ax=ax,
-                    plotsize=plotsize_default, smooth=True, xtype='datetime',
-                    datefmt=files[file]['datefmt'])
 
-                # Save the axis handle
-                if plots[plot]['ylim'] != 'auto':
-                    ax_pri = plt.gca()
+def render_plot(job):
+    '''
+    Renders one figure job built by plot_timeseries with the Agg backend and
+    saves it as png and pdf. Runs in a worker process.
 
-            # Add to legend
-            legend.append(var)
+    Parameters
+    ----------
+    job : dict
+        plot, ytitle, ylim, filename, and lines (label, style, axis, ylim,
+        datefmt, and the paths of the x and y arrays for each dataset).
 
-        # Add the legend
-        if len(legend) > 1:
-            ax.legend(legend)
-            
-        # Set the limits of the x axis
-        # !! This isn't working!
-        # ax_pri.set_xlim(plot_date_range)
+    Returns
+    -------
+    filename : str
+        Path of the saved figure (without the .png/.pdf extension).
 
-        # If specified, reset the limits of the y axis
-        if plots[plot]['ylim'] != 'auto':
-            ax_pri.set_ylim(plots[plot]['ylim'])
+    '''
+    plt.switch_backend('Agg')
+    # Create a new figure
+    fig, ax = plt.subplots(figsize=plotsize_default)
+    legend = []
+
+    # Plot each dataset
+    for line in job['lines']:
+        # Get the data
+        dset = pd.DataFrame({
+            'dt'    : np.load(line['arrays']['x'], mmap_mode='r'),
+            'ydata' : np.load(line['arrays']['y'], mmap_mode='r')})
+
+        # Plot the data
+        # If specified, plot as a scatterplot
+        if line['style'] == 'dots':
+
+            # If secondary axis specified, create & plot on secondary axis
+            if line['axis'] == 2:
+                ax_sec = ax.twinx()
+                ax_sec.scatter(dset['dt'], dset['ydata'])
+                ax_sec.set_ylabel(line['label'])
+                ax_sec.set_ylim(line['ylim'])
+
+            # Otherwise just plot
+            else:
+                plt.scatter(dset['dt'], dset['ydata'])
 
-        # Show and save the figure
-        fig.show()
-        fig.savefig(dirpath + '/' + plot + '.png')
-        fig.savefig(dirpath + '/' + plot + '.pdf', transparent=True)
+        # If scatterplot not specified, assume it's a line plot
+        else:
+            ResearchModules.plotData(
+                dset, 'dt', 'ydata', 'Date', job['ytitle'], line['label'],
+                ax=ax, plotsize=plotsize_default, smooth=True,
+                xtype='datetime', datefmt=line['datefmt'])
+
+        # Add to legend
+        legend.append(line['label'])
+
+    # Add the legend
+    if len(legend) > 1:
+        ax.legend(legend)
+
+    # Set the limits of the x axis
+    # !! This isn't working!
+    # ax.set_xlim(plot_date_range)
+
+    # If specified, reset the limits of the y axis
+    if job['ylim'] != 'auto':
+        ax.set_ylim(job['ylim'])
+
+    # Save the figure
+    fig.savefig(job['filename'] + '.png')
+    fig.savefig(job['filename'] + '.pdf', transparent=True)
+    plt.close(fig)
+    
+    return job['filename']
 
 
 def summarize_timeseries(data_files, plots=plots, date_ranges=date_ranges,
-                         dirpath=dirpath):
+                         dirpath=dirpath, fmt=summary_format):
     '''
-    Summarizes the timeseries collections generated by load_files,
-    saves summaries in an Excel file.
+    Summarizes the timeseries collections generated by load_files over each
+    of the date ranges and saves the summary as timeseries_summary.csv
+    (or .parquet/.xlsx, see fmt).
 
     Parameters
     ----------
-    data_files : dict of dicts
-        This is the output of load_files.
+    data_files : GSLMO_datasets.DatasetCatalog
+        Catalog of the datasets. This is the output of load_files.
     plots : dict of dicts, optional
         List of data sets (plots). The default is plots, which is defined
         in the global variables.
     date_ranges : list of lists, optional
         List of [start date, end date] as strings. The default is date_ranges,
         which is defined in the global variables.
-    directory : str, optional
-        Directory path for saving the Excel file. The default is dirpath,
+    dirpath : str, optional
+        Directory path for saving the summary file. The default is dirpath,
         which was defined in the global variables.
+    fmt : str, optional
+        Summary file format: 'csv' or 'parquet' (one tidy table), or 'xlsx'
+        (written in the background; call ResearchModules.wait_for_summaries
+        before exiting). The default is summary_format, which is defined in
+        the global variables.
 
     Returns
     -------
-    None.
+    summary : pandas.DataFrame
+        Table with one row per dataset and date range: plot, dataset,
+        date_start, date_end, count, min, min_dates, max, max_dates, avg,
+        stdev, and median.
 
     '''
-    # For each timeseries, generate a summary for each dataset
-    summaries = {}
+    # Collect the timeseries
+    series = {}
     for plot in plots:
         for var in plots[plot]['datasets']:
-            # Generate summary
-            print('Generating summary for ' + plot + ': ' + var + '...')
-            summary = pd.DataFrame(index = list(range(len(date_ranges))),
-                                   columns = ['date_start', 'date_end',
-                                              'min', 'min_dates',
-                                              'max', 'max_dates',
-                                              'avg', 'stdev', 'median'])
-            # Loop through each date series
-            for n, dates in enumerate(date_ranges):
-                # Snip date range
-                summary.loc[n,['date_start','date_end']] = dates
-                d_sub = (
-                    data_files[plots[plot]['datasets'][var]['file']]['data']
-                    [plots[plot]['datasets'][var]['ycol']+'_conv'].to_frame())
-                d_sub = d_sub[dates[0]:dates[1]]
-                
-                # Find min & min date
-                min_val = d_sub.min()[0]
-                summary.iloc[n]['min'] = min_val
-                datelist = (
-                    d_sub[d_sub[plots[plot]['datasets'][var]['ycol']
-                                + '_conv'] == min_val].resample(
-                                    '1D').mean().index)
-                summary.iloc[n]['min_dates'] = ', '.join(
-                    datelist.strftime('%Y-%m-%d'))
-                
-                # Find max & max date
-                max_val = d_sub.max()[0]
-                summary.iloc[n]['max'] = max_val
-                datelist = (
-                    d_sub[d_sub[plots[plot]['datasets'][var]['ycol']
-                                + '_conv'] == max_val].resample(
-                                    '1D').mean().index)
-                summary.iloc[n]['max_dates'] = ', '.join(
-                    datelist.strftime('%Y-%m-%d'))
+            series[(plot, var)] = data_files.series(
+                plots[plot]['datasets'][var]['file'],
+                plots[plot]['datasets'][var]['ycol'],
+                plots[plot]['datasets'][var]['conv'])
     
-                # Find avg, stdev, & median
-                summary.iloc[n]['avg'] = float(d_sub.mean())
-                summary.iloc[n]['stdev'] = float(d_sub.std())
-                summary.iloc[n]['median'] = float(d_sub.median())
-                
-            summaries[plot + ' ' + var] = summary
+    # Summarize every timeseries over every date range at once
+    print('Generating summaries...')
+    summary = ResearchModules.interval_summary(series, date_ranges)
+    summary.insert(0, 'plot', [plot for plot, var in summary['dataset']])
+    summary['dataset'] = [var for plot, var in summary['dataset']]
     
-    # Write summaries to Excel
-    writer = pd.ExcelWriter(dirpath + '/timeseries_summary.xlsx')
-    for summary in summaries:
-        print('Saving ' + summary + 'summary...')
-        if len(summary)<30:
-            summaries[summary].to_excel(writer, sheet_name = summary)
-        else:
-            summaries[summary].to_excel(writer, sheet_name=summary[0:30])
-    writer.save()
-    writer.close()
-            
-        
-                
-                
-                
+    # Save the summary
+    print('Saving summary...')
+    ResearchModules.save_summary(summary, dirpath + '/timeseries_summary',
+                                 fmt, index = False)
+    
+    return summary
 
 
 # %%
@@ -721,3 +643,4 @@ if __name__ == '__main__':
     '''
     plot_timeseries(data_files)
     summarize_timeseries(data_files)
+    ResearchModules.wait_for_summaries()